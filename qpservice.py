@@ -0,0 +1,25 @@
+from synthesizer.service import serve
+import argparse
+
+# python qpservice.py --port 8765 --workers 4
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Worker processes running jobs (default: one per CPU)",
+    )
+    args = parser.parse_args()
+    try:
+        serve(args.host, args.port, args.workers)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,14 @@
-from synthesizer.search import search_base
-import argparse, time
+from synthesizer.budget import Budget
+from synthesizer.search import (
+    search_astar,
+    search_base,
+    search_beam,
+    search_bottom_up,
+    search_deepening,
+    search_parallel,
+    stop_search,
+)
+import argparse, signal, sys, time
 
 # python qpsynth.py benchmarks/ghz.json baseline
 
@@ -7,12 +16,138 @@ import argparse, time
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("benchmark", type=str, help="Benchmark to run")
-    parser.add_argument("search", choices=["baseline"], help="Search method")
+    parser.add_argument(
+        "search",
+        choices=["baseline", "bottomup", "parallel", "beam", "deepening", "astar"],
+        help="Search method",
+    )
+    parser.add_argument(
+        "--dedup",
+        action="store_true",
+        help="Discard candidates observationally equivalent to earlier ones",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Worker processes of the parallel (default: one per CPU) and deepening (default: 1) searches",
+    )
+    parser.add_argument(
+        "--verifiers",
+        type=int,
+        default=0,
+        help="Processes verifying complete candidates of the baseline search (default: none)",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=3600,
+        help="Seconds the search runs for (default: 3600)",
+    )
+    parser.add_argument(
+        "--max-nodes",
+        type=int,
+        default=None,
+        help="Programs the search examines at most (default: no limit)",
+    )
+    parser.add_argument(
+        "--max-verifications",
+        type=int,
+        default=None,
+        help="Complete candidates the search runs on the examples at most (default: no limit)",
+    )
+    parser.add_argument(
+        "--max-rss",
+        type=float,
+        default=None,
+        help="Resident memory in MiB of the search and its workers at most (default: no limit)",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        type=str,
+        default=None,
+        help="File the baseline search state is saved to periodically and on exit",
+    )
+    parser.add_argument(
+        "--checkpoint-interval",
+        type=float,
+        default=300,
+        help="Seconds between checkpoints (default: 300)",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue the baseline search from the checkpoint (default: <benchmark>.ckpt)",
+    )
+    parser.add_argument(
+        "--resident",
+        type=int,
+        default=None,
+        help="Programs the baseline worklist keeps in memory; costlier ones are spilled to disk",
+    )
+    parser.add_argument(
+        "--width",
+        type=int,
+        default=1000,
+        help="Programs the beam search examines per cost level (default: 1000)",
+    )
+    parser.add_argument(
+        "--weight",
+        type=float,
+        default=10,
+        help="Weight of the fidelity heuristic of the astar search; 0 keeps it admissible (default: 10)",
+    )
     args = parser.parse_args()
+    if args.resume and args.checkpoint is None:
+        args.checkpoint = f"{args.benchmark}.ckpt"
+    # preemption usually sends SIGTERM: exit through Python so the search
+    # can save its checkpoint. With one, the baseline search stops at its
+    # next pop, where the worklist is consistent; so does Ctrl-C
+    if args.search == "baseline" and args.checkpoint is not None:
+        signal.signal(signal.SIGTERM, stop_search)
+        signal.signal(signal.SIGINT, stop_search)
+    else:
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+    budget = Budget(
+        wall=args.timeout,
+        nodes=args.max_nodes,
+        verifications=args.max_verifications,
+        rss=None if args.max_rss is None else int(args.max_rss * 2**20),
+    )
 
     start = time.time()
     if args.search == "baseline":
-        result = search_base(args.benchmark)
+        result = search_base(
+            args.benchmark,
+            dedup=args.dedup,
+            verifiers=args.verifiers,
+            budget=budget,
+            checkpoint=args.checkpoint,
+            resume=args.resume,
+            interval=args.checkpoint_interval,
+            resident=args.resident,
+        )
+    elif args.search == "bottomup":
+        result = search_bottom_up(args.benchmark, budget=budget)
+    elif args.search == "beam":
+        result = search_beam(
+            args.benchmark, width=args.width, dedup=args.dedup, budget=budget
+        )
+    elif args.search == "deepening":
+        result = search_deepening(
+            args.benchmark,
+            dedup=args.dedup,
+            budget=budget,
+            workers=args.workers or 1,
+        )
+    elif args.search == "astar":
+        result = search_astar(
+            args.benchmark, weight=args.weight, dedup=args.dedup, budget=budget
+        )
+    elif args.search == "parallel":
+        result = search_parallel(
+            args.benchmark, workers=args.workers, dedup=args.dedup, budget=budget
+        )
     print(str(result))
     end = time.time()
     print(f"Time: {end-start}")
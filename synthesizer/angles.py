@@ -0,0 +1,224 @@
+import itertools, math, numpy as np
+from typing import Dict, Iterator, List, Tuple
+
+from synthesizer.language import *
+from synthesizer.compiler import GateList, compile_node, evaluate
+from synthesizer.setup import SpecGroup
+from synthesizer.simulator import apply, initial_state, program_variables, view
+from synthesizer.transition import (
+    Path,
+    fill,
+    fill_theta,
+    linear_aexp,
+    loop_vars,
+    rotation_paths,
+)
+
+SWEEPS = 20
+GRID = np.linspace(0, math.pi / 2, 257)  # half angles, cos^2 = p/q in [0, 1]
+FIDELITY = 1 - 1e-6
+NEAR = 64  # assignments tried around the optimizer's angles when it misses
+
+
+class Unrunnable(Exception):
+    # the program fails on some example whatever its angles are
+    pass
+
+
+######### Unrolling #########
+class Unrolled(GateList):
+    # gate list of a program whose unfilled rotations are placeholders (see
+    # unroll): each one gets a placeholder angle and its instance is recorded
+    # as (gate index, node path, loop values)
+    def __init__(self, paths: List[Path], n: int):
+        super().__init__()
+        self.paths, self.n = paths, n
+        self.rotations = []
+
+    def unfilled(self, slot: int, variables: dict) -> float:
+        path = self.paths[slot]
+        values = {str(var): variables[str(var)] for var in loop_vars[: path.count("body")]}
+        self.rotations.append((len(self), path, dict(values, n=self.n)))
+        return math.pi / 2
+
+
+def unroll(target: Pgm, n: int, bits: List[str]):
+    # flat gate list where unfilled rotations get a placeholder angle, and
+    # the rotation instances. The program is lowered by the compiler with
+    # every unfilled rotation numbered by its position in rotation_paths
+    paths = [path for path, _ in rotation_paths(target)]
+    marked = fill(target, {path: Integer(k) for k, path in enumerate(paths)}, p=None)
+    gates = Unrolled(paths, n)
+    compile_node(marked)(gates, program_variables(n, bits))
+    return list(gates), gates.rotations
+
+
+def apply_inverse(state: np.ndarray, n: int, gates) -> np.ndarray:
+    # h, x and cx are self-inverse, rotations are undone by negating the angle
+    for gate, qubits, params in reversed(gates):
+        if gate in ("ry", "cry"):
+            params = (-params[0],)
+        apply(state, n, [(gate, qubits, params)])
+    return state
+
+
+######### Angle optimization #########
+def best_angle(before: np.ndarray, after: np.ndarray, n: int, gate) -> Tuple[float, bool]:
+    # half angle t in [0, pi/2] maximizing the total fidelity between the
+    # rotated state and the state the rest of the program has to map to the
+    # output; flat when the rotation does not change the fidelity
+    name, qubits, _ = gate
+    fixed = {} if name == "ry" else {qubits[0]: 1}
+    qubit = qubits[-1]
+    batch = before.shape[: before.ndim - n]
+
+    def amplitudes(state: np.ndarray, value: int) -> np.ndarray:
+        return view(state, n, {**fixed, qubit: value}).reshape(batch + (-1,))
+
+    z, o = amplitudes(before, 0), amplitudes(before, 1)
+    phi_z, phi_o = np.conj(amplitudes(after, 0)), np.conj(amplitudes(after, 1))
+    b = (phi_z * z + phi_o * o).sum(axis=-1)
+    c = (phi_o * z - phi_z * o).sum(axis=-1)
+    a = (np.conj(after) * before).reshape(batch + (-1,)).sum(axis=-1) - b
+    # |a + cos(t) b + sin(t) c|^2 summed over the batch
+    terms = [
+        np.sum(np.abs(a) ** 2),
+        np.sum(np.abs(b) ** 2),
+        np.sum(np.abs(c) ** 2),
+        2 * np.sum((np.conj(a) * b).real),
+        2 * np.sum((np.conj(a) * c).real),
+        2 * np.sum((np.conj(b) * c).real),
+    ]
+
+    def fidelity(t):
+        cos, sin = np.cos(t), np.sin(t)
+        aa, bb, cc, ab, ac, bc = terms
+        return aa + cos**2 * bb + sin**2 * cc + cos * ab + sin * ac + cos * sin * bc
+
+    values = fidelity(GRID)
+    if values.max() - values.min() < 1e-12:
+        return 0.0, True
+    k = int(np.argmax(values))
+    low, high = GRID[max(k - 1, 0)], GRID[min(k + 1, len(GRID) - 1)]
+    for _ in range(40):  # golden-section refinement inside the grid cell
+        m1, m2 = high - (high - low) * 0.618, low + (high - low) * 0.618
+        if fidelity(m1) < fidelity(m2):
+            low = m1
+        else:
+            high = m2
+    return (low + high) / 2, False
+
+
+def optimize(gates, rotations, n: int, input: np.ndarray, output: np.ndarray):
+    # coordinate ascent over the rotation instances: each angle is set to its
+    # best value given the state before it and the output pulled back
+    # through the gates after it. Returns the ratios found and whether they
+    # reach every example within FIDELITY; a local search, so a miss does not
+    # prove the examples unreachable
+    slots = [index for index, _, _ in rotations]
+    output = output / np.linalg.norm(output, axis=-1, keepdims=True)
+    free = [False] * len(slots)
+    previous = None
+    for _ in range(SWEEPS):
+        backward, state, end = [], initial_state(output, n), len(gates)
+        for index in reversed(slots):
+            apply_inverse(state, n, gates[index + 1 : end])
+            backward.append(state.copy())
+            end = index + 1
+        backward.reverse()
+        state, begin = initial_state(input, n), 0
+        for k, index in enumerate(slots):
+            apply(state, n, gates[begin:index])
+            t, free[k] = best_angle(state, backward[k], n, gates[index])
+            gates[index] = (gates[index][0], gates[index][1], (2 * t,))
+            apply(state, n, gates[index : index + 1])
+            begin = index + 1
+        apply(state, n, gates[begin:])
+        overlap = np.abs(
+            (np.conj(initial_state(output, n)) * state).reshape(len(output), -1).sum(-1)
+        )
+        fidelity = overlap**2
+        if fidelity.min() >= 1 - 1e-12:
+            break
+        if previous is not None and fidelity.sum() - previous < 1e-9:
+            break
+        previous = fidelity.sum()
+    ratios = [
+        (path, values, math.cos(gates[index][2][0] / 2) ** 2)
+        for (index, path, values), is_free in zip(rotations, free)
+        if not is_free
+    ]
+    return ratios, fidelity.min() >= FIDELITY
+
+
+######### Expression fitting #########
+def fit_theta(samples: List[Tuple[dict, float]], depth: int) -> Aexp:
+    # smallest integer linear q in (loop variables, n, 1) with p/q = ratio
+    # for p = 1 on every sample, trying expressions with fewer variables first
+    if len(samples) == 0:
+        return Integer(1)
+    ratio = np.array([r for _, r in samples])
+    if ratio.min() <= 1e-9:
+        return None
+    columns = [None, N()] + loop_vars[:depth][::-1]
+    for k in range(1, len(columns) + 1):
+        rows = np.array(
+            [[1 if v is None else values[str(v)] for v in columns[:k]] for values, _ in samples],
+            dtype=float,
+        )
+        coeffs = np.round(np.linalg.lstsq(rows, 1 / ratio, rcond=None)[0])
+        q = rows @ coeffs
+        if np.all(q >= 1) and np.allclose(1 / q, ratio, atol=1e-4):
+            return linear_aexp([(int(c), v) for c, v in zip(coeffs, columns)][::-1])
+    return None
+
+
+######### Solver #########
+def solve_angles(target: Pgm, groups: List[SpecGroup]):
+    # best rotation ratio p/q of every rotation instance, grouped by node,
+    # and whether they reach every output (see optimize). Raises Unrunnable
+    # when the program cannot be unrolled: the gates and qubits do not
+    # depend on the angles
+    samples, reached = {}, True
+    for group in groups:
+        try:
+            gates, rotations = unroll(target, group.n, group.bits)
+        except Exception as e:
+            raise Unrunnable(str(e)) from e
+        res, ok = optimize(gates, rotations, group.n, group.input, group.output)
+        reached = reached and ok
+        for path, values, ratio in res:
+            samples.setdefault(path, []).append((values, ratio))
+    return samples, reached
+
+
+def solve_theta(target: Pgm, samples: Dict[Path, list]) -> Pgm:
+    # program with the fitted rotation expressions, None when some node has
+    # no integer linear fit
+    thetas = {}
+    for path, values in samples.items():
+        thetas[path] = fit_theta(values, path.count("body"))
+        if thetas[path] is None:
+            return None
+    return fill(target, thetas)
+
+
+def distance(q: Aexp, samples: List[Tuple[dict, float]]) -> float:
+    # how far 1/q is from the sampled ratios
+    res = 0.0
+    for values, ratio in samples:
+        try:
+            res += abs(1 / evaluate(q, values) - ratio)
+        except ZeroDivisionError:
+            return math.inf
+    return res
+
+
+def near_theta(target: Pgm, samples: Dict[Path, list], ns: List[int]) -> Iterator[Pgm]:
+    # the NEAR assignments of fill_theta closest to the sampled ratios: the
+    # options of each rotation ranked by distance, simplest first for the
+    # rotations the optimizer left without samples
+    def order(path: Path, options: List[Aexp]) -> List[Aexp]:
+        return sorted(options, key=lambda q: distance(q, samples.get(path, [])))
+
+    return itertools.islice(fill_theta(ns, target, order), NEAR)
@@ -0,0 +1,207 @@
+import os, resource, sys, time, numpy as np
+from dataclasses import dataclass
+from typing import List
+
+from synthesizer.language import Pgm
+from synthesizer.setup import SpecGroup
+from synthesizer.simulator import fidelity
+
+RSS_INTERVAL = 0.1  # seconds between readings of the resident set size
+
+REASONS = {
+    "solved": "solution found",
+    "exhausted": "search space exhausted",
+    "wall": "time budget spent",
+    "nodes": "node budget spent",
+    "verifications": "verification budget spent",
+    "rss": "memory budget spent",
+}
+
+
+def resident(pid: int = None) -> int:
+    # resident set size in bytes of process pid, this one by default
+    try:
+        with open(f"/proc/{pid or 'self'}/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        if pid is not None:
+            return 0  # exited, or no procfs
+        # no procfs: the peak size instead, in kilobytes except on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class BudgetExceeded(Exception):
+    # stops a recursive search when a limit runs out
+    def __init__(self, reason: str):
+        super().__init__(REASONS[reason])
+        self.reason = reason
+
+
+@dataclass
+class Budget:
+    # limits of one search, None for none: wall-clock seconds, programs
+    # examined (candidates enumerated by the bottom-up search), complete
+    # candidates run on the examples (each angle assignment tried for a
+    # program with rotations counts), and resident memory in bytes of the
+    # search and its worker processes
+    wall: float = 3600
+    nodes: int = None
+    verifications: int = None
+    rss: int = None
+
+
+class Incumbent:
+    # best candidate examined so far: most examples passed, then highest
+    # mean fidelity to the expected outputs, the first one found on ties
+    def __init__(self, groups: List[SpecGroup]):
+        self.groups = groups
+        self.examples = sum(len(group.index) for group in groups)
+        self.program = None
+        self.passed = -1
+        self.fidelity = -1.0
+
+    def observe(self, target: Pgm, states: List[np.ndarray], passed: np.ndarray):
+        # target's output states and pass/fail flags (see check_batch)
+        count = int(np.sum(passed))
+        if count < self.passed:
+            return
+        res = 0.0
+        for state, group in zip(states, self.groups):
+            if isinstance(state, np.ndarray) and state.shape == group.output.shape:
+                res += float(np.sum(fidelity(state, group.output)))
+        self.offer(target, count, res / self.examples)
+
+    def offer(self, target: Pgm, passed: int, fidelity: float):
+        if (passed, fidelity) > (self.passed, self.fidelity):
+            self.program, self.passed, self.fidelity = target, passed, fidelity
+
+
+@dataclass
+class Result:
+    # outcome of a search: the solution if one was found, otherwise the best
+    # candidate examined before the search stopped, and why it stopped
+    # (a key of REASONS)
+    solution: Pgm
+    best: Pgm
+    passed: int  # examples best passes
+    examples: int
+    fidelity: float  # mean fidelity of best's outputs to the expected ones
+    reason: str
+    stats: dict  # time, nodes, verifications, rss (peak bytes) and more
+
+    def to_dict(self) -> dict:
+        return {
+            "reason": self.reason,
+            "program": None if self.best is None else str(self.best),
+            "passed": self.passed,
+            "examples": self.examples,
+            "fidelity": self.fidelity,
+            "stats": self.stats,
+        }
+
+    def __str__(self) -> str:
+        if self.solution is not None:
+            return str(self.solution)
+        res = (
+            f"No solution: {REASONS[self.reason]} after {self.stats['nodes']} programs"
+        )
+        if self.best is None:
+            return res
+        return (
+            f"{res}. Best candidate passes {self.passed}/{self.examples} examples"
+            f" (fidelity {self.fidelity:.4f}):\n{self.best}"
+        )
+
+
+class Meter:
+    # what a search used of its budget. Searches count the programs they
+    # examine and ask exhausted() before each one; verifications are counted
+    # where candidates are run
+    def __init__(self, budget: Budget = None):
+        self.budget = budget or Budget()
+        self.start = time.time()
+        self.nodes = 0
+        self.verifications = 0
+        self.pids = []  # ids of worker processes whose memory counts too
+        self.measured = 0.0
+        self.rss = self.peak = 0
+
+    def count(self):
+        self.nodes += 1
+
+    def elapsed(self) -> float:
+        return time.time() - self.start
+
+    def measure(self):
+        self.rss = resident() + sum(resident(pid) for pid in list(self.pids))
+        self.peak = max(self.peak, self.rss)
+        self.measured = time.time()
+
+    def exhausted(self) -> str:
+        # the limit that ran out, or None
+        budget = self.budget
+        if budget.wall is not None and self.elapsed() >= budget.wall:
+            return "wall"
+        if budget.nodes is not None and self.nodes >= budget.nodes:
+            return "nodes"
+        if (
+            budget.verifications is not None
+            and self.verifications >= budget.verifications
+        ):
+            return "verifications"
+        if time.time() - self.measured >= RSS_INTERVAL:
+            self.measure()
+            if budget.rss is not None and self.rss >= budget.rss:
+                return "rss"
+        return None
+
+    def remaining(self, parts: int = 1) -> Budget:
+        # what is left, shared between parts searches running at once
+        budget = self.budget
+
+        def share(limit, used):
+            return None if limit is None else max(limit - used, 0) // parts
+
+        return Budget(
+            wall=None if budget.wall is None else budget.wall - self.elapsed(),
+            nodes=share(budget.nodes, self.nodes),
+            verifications=share(budget.verifications, self.verifications),
+            rss=share(budget.rss, 0),
+        )
+
+    def result(
+        self,
+        incumbent: Incumbent,
+        solution: Pgm = None,
+        reason: str = "exhausted",
+        **stats,
+    ) -> Result:
+        self.measure()
+        stats = dict(
+            time=self.elapsed(),
+            nodes=self.nodes,
+            verifications=self.verifications,
+            rss=self.peak,
+            **stats,
+        )
+        if solution is not None:
+            return Result(
+                solution,
+                solution,
+                incumbent.examples,
+                incumbent.examples,
+                1.0,
+                "solved",
+                stats,
+            )
+        passed = max(incumbent.passed, 0)
+        return Result(
+            None,
+            incumbent.program,
+            passed,
+            incumbent.examples,
+            max(incumbent.fidelity, 0.0),
+            reason,
+            stats,
+        )
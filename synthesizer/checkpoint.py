@@ -0,0 +1,42 @@
+import hashlib, os, pickle, zlib
+from typing import List
+
+from synthesizer.setup import Spec
+
+VERSION = 3  # 2: structural seen-set digests, 3: prefix costs in --dedup
+
+
+def spec_digest(gates: List[str], specification: List[Spec]) -> str:
+    # identifies the specification a checkpoint was taken for
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr(gates).encode())
+    for example in specification:
+        digest.update(repr((example.n, example.bits)).encode())
+        digest.update(example.input.tobytes())
+        digest.update(example.output.tobytes())
+    return digest.hexdigest()
+
+
+def save_checkpoint(path: str, state: dict):
+    # written next to the old checkpoint and renamed over it, so a save cut
+    # short by preemption leaves the previous checkpoint intact. Interned
+    # subtrees are shared objects, so pickle stores each of them once
+    data = zlib.compress(
+        pickle.dumps(dict(state, version=VERSION), protocol=pickle.HIGHEST_PROTOCOL)
+    )
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+
+
+def load_checkpoint(path: str, digest: str) -> dict:
+    with open(path, "rb") as file:
+        state = pickle.loads(zlib.decompress(file.read()))
+    if state.get("version") != VERSION:
+        raise ValueError(f"checkpoint {path} has version {state.get('version')}")
+    if state["spec"] != digest:
+        raise ValueError(f"checkpoint {path} was taken for another specification")
+    return state
@@ -0,0 +1,262 @@
+import math
+from typing import Callable, Tuple, Union
+
+from synthesizer.language import *
+
+# structurally identical subtrees share one closure
+compiled = {}
+COMPILED_LIMIT = 2**16
+
+# unrolled gate lists per (program, n, bits, loop variables in scope)
+lowered = {}
+LOWERED_LIMIT = 2**16
+
+
+def compile_node(target) -> Callable:
+    # instructions compile to run(backend, variables), aexps and bexps to
+    # value(variables); backend provides h/x/ry on normalized qubit indices
+    key = target
+    if key in compiled:
+        return compiled[key]
+    if len(compiled) >= COMPILED_LIMIT:
+        compiled.clear()
+    res = cases[type(target)](target)
+    compiled[key] = res
+    return res
+
+
+def evaluate(target: Aexp, variables: dict):
+    return compile_node(target)(variables)
+
+
+class GateList(list):
+    # gate backend that records (gate, qubits, params) instead of applying them
+    def h(self, qubit: int):
+        self.append(("h", (qubit,), ()))
+
+    def x(self, qubit: int, control: int = None):
+        if control is None:
+            self.append(("x", (qubit,), ()))
+        else:
+            self.append(("cx", (control, qubit), ()))
+
+    def ry(self, qubit: int, theta: float, control: int = None):
+        if control is None:
+            self.append(("ry", (qubit,), (theta,)))
+        else:
+            self.append(("cry", (control, qubit), (theta,)))
+
+
+def lower(target, variables: dict) -> Tuple[Tuple[str, Tuple[int, ...], tuple]]:
+    # flat gate list of a terminal program for concrete n and bits; loop
+    # variables left behind by the program are written back to variables
+    scope = tuple(sorted((k, v) for k, v in variables.items() if k not in ("n", "bit")))
+    key = (target, variables["n"], tuple(variables.get("bit", ())), scope)
+    if key not in lowered:
+        if len(lowered) >= LOWERED_LIMIT:
+            lowered.clear()
+        gates, after = GateList(), dict(variables)
+        try:
+            compile_node(target)(gates, after)
+            lowered[key] = (
+                tuple(gates),
+                {k: after[k] for k in after if k not in ("n", "bit")},
+            )
+        except Exception:
+            lowered[key] = None
+    if lowered[key] is None:
+        raise ValueError(f"{target} cannot be executed")
+    gates, loop_variables = lowered[key]
+    variables.update(loop_variables)
+    return gates
+
+
+def qubit_index(value: int, n: int) -> int:
+    # mirrors qbits[value] on a python list
+    if not -n <= value < n:
+        raise IndexError(f"qubit index {value} out of range for {n} qubits")
+    return value % n
+
+
+def rotation(p, q) -> float:
+    # Ry(rads=2*np.arccos(math.sqrt(p/q)))
+    ratio = p / q
+    if not 0 <= ratio <= 1:
+        raise ValueError(f"invalid rotation ratio {ratio}")
+    return 2 * math.acos(math.sqrt(ratio))
+
+
+######### Instruction #########
+def program_case(target: Pgm):
+    return compile_node(target.inst)
+
+
+def lst_case(target: Seq):
+    left, right = compile_node(target.left), compile_node(target.right)
+
+    def run(backend, variables):
+        left(backend, variables)
+        right(backend, variables)
+
+    return run
+
+
+def for_case(target: For):
+    name = str(target.var)
+    start, end = compile_node(target.start), compile_node(target.end)
+    body = compile_node(target.body)
+
+    def run(backend, variables):
+        for i in range(start(variables), end(variables)):
+            variables[name] = i
+            body(backend, variables)
+
+    return run
+
+
+def if_case(target: If):
+    cond = compile_node(target.cond)
+    then, else_ = compile_node(target.then), compile_node(target.else_)
+
+    def run(backend, variables):
+        if cond(variables):
+            then(backend, variables)
+        else:
+            else_(backend, variables)
+
+    return run
+
+
+def skip_case(target: Skip):
+    def run(backend, variables):
+        pass
+
+    return run
+
+
+def single_gate(target: Union[H, X]):
+    qreg = compile_node(target.qreg)
+    name = type(target).__name__.lower()
+
+    def run(backend, variables):
+        getattr(backend, name)(qubit_index(qreg(variables), variables["n"]))
+
+    return run
+
+
+def angle(target: Union[Ry, CRy]) -> Callable:
+    # (backend, variables) -> rotation angle. A rotation with p None and q
+    # set is a placeholder numbered by q whose angle the backend chooses (see
+    # angles.unroll); one with q None too is unfilled and cannot be executed
+    if target.p is None:
+        if target.q is None:
+            return hole_case(target)
+        slot = target.q.value
+        return lambda backend, variables: backend.unfilled(slot, variables)
+    p, q = compile_node(target.p), compile_node(target.q)
+    return lambda backend, variables: rotation(p(variables), q(variables))
+
+
+def ry_case(target: Ry):
+    theta, qreg = angle(target), compile_node(target.qreg)
+
+    def run(backend, variables):
+        qubit = qubit_index(qreg(variables), variables["n"])
+        backend.ry(qubit, theta(backend, variables))
+
+    return run
+
+
+def controlled_qubits(qreg1: Callable, qreg2: Callable, variables: dict):
+    n = variables["n"]
+    control, qubit = qubit_index(qreg1(variables), n), qubit_index(qreg2(variables), n)
+    if control == qubit:
+        raise ValueError("control and target qubits overlap")
+    return control, qubit
+
+
+def cx_case(target: CX):
+    qreg1, qreg2 = compile_node(target.qreg1), compile_node(target.qreg2)
+
+    def run(backend, variables):
+        control, qubit = controlled_qubits(qreg1, qreg2, variables)
+        backend.x(qubit, control)
+
+    return run
+
+
+def cry_case(target: CRy):
+    theta = angle(target)
+    qreg1, qreg2 = compile_node(target.qreg1), compile_node(target.qreg2)
+
+    def run(backend, variables):
+        control, qubit = controlled_qubits(qreg1, qreg2, variables)
+        backend.ry(qubit, theta(backend, variables), control)
+
+    return run
+
+
+######### Aexp / Bexp #########
+def binary(op: Callable):
+    def case(target):
+        left, right = compile_node(target.left), compile_node(target.right)
+        return lambda variables: op(left(variables), right(variables))
+
+    return case
+
+
+def integer_case(target: Integer):
+    if type(target.value) == int:
+        value = target.value
+        return lambda variables: value
+    return compile_node(target.value)
+
+
+def var_case(target: Union[N, I, J]):
+    name = str(target)
+    return lambda variables: variables[name]
+
+
+def bit_case(target: Bit):
+    index = compile_node(target.index)
+    return lambda variables: variables["bit"][index(variables)]
+
+
+def hole_case(target: Hole):
+    def run(*args):
+        raise ValueError(f"cannot execute a program with hole {target}")
+
+    return run
+
+
+cases = {
+    Pgm: program_case,
+    Seq: lst_case,
+    For: for_case,
+    If: if_case,
+    Skip: skip_case,
+    H: single_gate,
+    X: single_gate,
+    Ry: ry_case,
+    CX: cx_case,
+    CRy: cry_case,
+    Add: binary(lambda l, r: l + r),
+    Sub: binary(lambda l, r: l - r),
+    Mul: binary(lambda l, r: l * r),
+    Div: binary(lambda l, r: l // r),
+    Equal: binary(lambda l, r: l == r),
+    NEqual: binary(lambda l, r: l != r),
+    Less: binary(lambda l, r: l < r),
+    LessEqual: binary(lambda l, r: l <= r),
+    Integer: integer_case,
+    N: var_case,
+    I: var_case,
+    J: var_case,
+    Bit: bit_case,
+    C_hole: hole_case,
+    G_hole: hole_case,
+    A_hole: hole_case,
+    B_hole: hole_case,
+    V_hole: hole_case,
+    Z_hole: hole_case,
+}
@@ -0,0 +1,74 @@
+import hashlib, numpy as np
+from typing import List
+
+from synthesizer.language import *
+from synthesizer.prune import tally
+from synthesizer.setup import SpecGroup, run_batch
+from synthesizer.simulator import PrefixCache, dephase, flatten
+
+
+def fingerprint(states: List[np.ndarray], decimals: int = 6) -> bytes:
+    # output states of all examples, normalized for global phase and rounded;
+    # None when the program fails on some example
+    digest = hashlib.blake2b(digest_size=16)
+    for state in states:
+        if state is None:
+            return None
+        k = np.argmax(np.round(np.abs(state), decimals), axis=-1)[..., None]
+        state = state * dephase(np.take_along_axis(state, k, axis=-1))
+        digest.update((np.round(state, decimals) + 0).tobytes())  # + 0 drops -0.0
+    return digest.digest()
+
+
+def sequence(statements: List[Instruction]) -> Instruction:
+    if len(statements) == 1:
+        return statements[0]
+    return Seq(statements[0], sequence(statements[1:]))
+
+
+class ObservationalEquivalence:
+    # discards candidates that behave like an earlier one on every example
+    def __init__(self, decimals: int = 6):
+        self.decimals = decimals
+        self.outputs = set()
+        self.prefixes = {}  # key -> cost of the cheapest prefix seen
+
+    def seen_outputs(self, states: List[np.ndarray]) -> bool:
+        # terminal candidates: identical outputs on every spec input
+        key = fingerprint(states, self.decimals)
+        if key is None:
+            return False
+        if key in self.outputs:
+            return True
+        self.outputs.add(key)
+        return False
+
+    def seen_prefix(
+        self, target: Pgm, groups: List[SpecGroup], cache: PrefixCache = None
+    ) -> bool:
+        # partial programs: the terminal statements before the first hole reach
+        # the same states as an earlier candidate whose remaining statements
+        # are identical, so both have the same completions. The prune limits
+        # count the whole program, so the prefixes must also have the same
+        # tally: For(i,0,2,X(i)) and X(0); X(1) reach the same state, but
+        # only the latter leaves room for a loop in the completion. Only a
+        # prefix at least as expensive as the stored one is discarded, so a
+        # cheapest completion is kept whatever order candidates come in (the
+        # depth-first deepening rounds do not follow cost)
+        statements = flatten(target)
+        k = 0
+        while k < len(statements) and statements[k].terminal():
+            k += 1
+        if k == 0 or k == len(statements):
+            return False
+        prefix = Pgm(sequence(statements[:k]))
+        if prefix.has_syntax(Ry()) or prefix.has_syntax(CRy()):
+            return False  # rotation angles are filled after the search
+        key = fingerprint(run_batch(prefix, groups, cache), self.decimals)
+        if key is None:
+            return False
+        key = (key, tally(prefix), tuple(statements[k:]))
+        if self.prefixes.get(key, prefix.cost + 1) <= prefix.cost:
+            return True
+        self.prefixes[key] = prefix.cost
+        return False
@@ -1,14 +1,110 @@
 from __future__ import annotations
-from dataclasses import dataclass
 from textwrap import indent
+import weakref
 
 # simplify 함수는 ZeroDivisionError 발생 가능
 TAB = "    "
 
 
-@dataclass
-class Pgm:
-    inst: Instruction = None
+class Node:
+    # interned and immutable: building a node equal to a live one returns that
+    # node, so equal subtrees are shared and == is identity; hash, cost, depth
+    # and the terminal flag are computed once here. Syntax patterns such as
+    # Ry() given to has_syntax, with every field None, leave them as None. _tally
+    # holds the prune counts of the node once prune.tally has computed them,
+    # _digest its structural digest once worklist.fingerprint has.
+    __slots__ = (
+        "_hash",
+        "_cost",
+        "_depth",
+        "_terminal",
+        "_simplified",
+        "_tally",
+        "_digest",
+        "__weakref__",
+    )
+    _fields = ()
+    _interned = weakref.WeakValueDictionary()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._fields = cls._fields + tuple(cls.__dict__.get("__slots__", ()))
+
+    def __new__(cls, *args, **kwargs):
+        values = list(args) + [None] * (len(cls._fields) - len(args))
+        for name, value in kwargs.items():
+            values[cls._fields.index(name)] = value
+        key = (cls, *values, *map(type, values))  # keeps Integer(1) != Integer(True)
+        node = Node._interned.get(key)
+        if node is None:
+            node = object.__new__(cls)
+            for name, value in zip(cls._fields, values):
+                object.__setattr__(node, name, value)
+            object.__setattr__(node, "_hash", hash(key))
+            object.__setattr__(node, "_simplified", None)
+            object.__setattr__(node, "_tally", None)
+            object.__setattr__(node, "_digest", None)
+            # a syntax pattern has every field None (holes inherit theirs);
+            # abstract classes have no compute methods
+            pattern = (
+                len(values) > 0
+                and all(value is None for value in values)
+                and not isinstance(node, Hole)
+            )
+            for name in ("cost", "depth", "terminal"):
+                compute = getattr(node, f"compute_{name}", None)
+                value = None if pattern or compute is None else compute()
+                object.__setattr__(node, f"_{name}", value)
+            Node._interned[key] = node
+        return node
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __eq__(self, other) -> bool:
+        return self is other
+
+    def __hash__(self) -> int:
+        return self._hash
+
+    def __reduce__(self):
+        # unpickled nodes are interned again
+        return type(self), tuple(getattr(self, name) for name in self._fields)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    @property
+    def cost(self) -> int:
+        return self._cost
+
+    @property
+    def depth(self) -> int:
+        return self._depth
+
+    def terminal(self) -> bool:
+        return self._terminal
+
+    def simplify(self):
+        # pure on interned nodes, so computed once; a rebuilt ancestor only
+        # re-simplifies the nodes that are new
+        res = self._simplified
+        if res is None:
+            res = self.compute_simplify()
+            # True instead of a reference to itself, which would be a cycle
+            object.__setattr__(self, "_simplified", True if res is self else res)
+        return self if res is True else res
+
+
+class Pgm(Node):
+    inst: Instruction
+    __slots__ = ("inst",)
 
     def __str__(self) -> str:
         return str(self.inst)
@@ -19,15 +115,13 @@ class Pgm:
     def __lt__(self, other: "Pgm") -> bool:
         return self.cost < other.cost
 
-    @property
-    def cost(self) -> int:
+    def compute_cost(self) -> int:
         return self.inst.cost
 
-    @property
-    def depth(self) -> int:
+    def compute_depth(self) -> int:
         return 1 + self.inst.depth
 
-    def terminal(self) -> bool:
+    def compute_terminal(self) -> bool:
         return self.inst.terminal()
 
     def has_syntax(self, syntax) -> bool:
@@ -40,19 +134,19 @@ class Pgm:
             return self.inst.continued(syntax.inst)
         return False
 
-    def simplify(self):
+    def compute_simplify(self):
         return Pgm(self.inst.simplify())
 
 
 ######### Instruction #########
-class Instruction:
-    pass
+class Instruction(Node):
+    __slots__ = ()
 
 
-@dataclass
 class Seq(Instruction):
-    left: Instruction = None
-    right: Instruction = None
+    left: Instruction
+    right: Instruction
+    __slots__ = ("left", "right")
 
     def __str__(self) -> str:
         return f"{str(self.left)}\n{str(self.right)}"
@@ -60,15 +154,13 @@ class Seq(Instruction):
     def __repr__(self) -> str:
         return f"Seq({self.left}, {self.right})"
 
-    @property
-    def cost(self) -> int:
+    def compute_cost(self) -> int:
         return 5 + self.left.cost + self.right.cost
 
-    @property
-    def depth(self) -> int:
+    def compute_depth(self) -> int:
         return 1 + max(self.left.depth, self.right.depth)
 
-    def terminal(self) -> bool:
+    def compute_terminal(self) -> bool:
         return self.left.terminal() and self.right.terminal()
 
     def has_syntax(self, syntax) -> bool:
@@ -83,16 +175,16 @@ class Seq(Instruction):
             )
         return False
 
-    def simplify(self):
+    def compute_simplify(self):
         return Seq(self.left.simplify(), self.right.simplify())
 
 
-@dataclass
 class For(Instruction):
-    var: Var = None
-    start: Integer = None
-    end: Integer = None
-    body: Instruction = None
+    var: Var
+    start: Integer
+    end: Integer
+    body: Instruction
+    __slots__ = ("var", "start", "end", "body")
 
     def __str__(self) -> str:
         return f"for {str(self.var)} in range({str(self.start)}, {str(self.end)}):\n{indent(str(self.body),TAB)}"
@@ -100,15 +192,13 @@ class For(Instruction):
     def __repr__(self) -> str:
         return f"For({self.var}, {self.start}, {self.end}, {self.body})"
 
-    @property
-    def cost(self) -> int:
+    def compute_cost(self) -> int:
         return 3 + self.var.cost + self.start.cost + self.end.cost + self.body.cost
 
-    @property
-    def depth(self) -> int:
+    def compute_depth(self) -> int:
         return 1 + max(self.start.depth, self.end.depth, self.body.depth)
 
-    def terminal(self) -> bool:
+    def compute_terminal(self) -> bool:
         return (
             self.var.terminal()
             and self.start.terminal()
@@ -136,7 +226,7 @@ class For(Instruction):
             )
         return False
 
-    def simplify(self):
+    def compute_simplify(self):
         return For(
             self.var.simplify(),
             self.start.simplify(),
@@ -145,11 +235,11 @@ class For(Instruction):
         )
 
 
-@dataclass
 class If(Instruction):
-    cond: Bexp = None
-    then: Instruction = None
-    else_: Instruction = None
+    cond: Bexp
+    then: Instruction
+    else_: Instruction
+    __slots__ = ("cond", "then", "else_")
 
     def __str__(self) -> str:
         if self.else_ == Skip():
@@ -159,15 +249,13 @@ class If(Instruction):
     def __repr__(self) -> str:
         return f"If({self.cond}, {self.then}, {self.else_})"
 
-    @property
-    def cost(self) -> int:
+    def compute_cost(self) -> int:
         return 30 + self.cond.cost + self.then.cost + self.else_.cost
 
-    @property
-    def depth(self) -> int:
+    def compute_depth(self) -> int:
         return 1 + max(self.then.depth, self.else_.depth)
 
-    def terminal(self) -> bool:
+    def compute_terminal(self) -> bool:
         return self.cond.terminal() and self.then.terminal() and self.else_.terminal()
 
     def has_syntax(self, syntax) -> bool:
@@ -188,7 +276,7 @@ class If(Instruction):
             )
         return False
 
-    def simplify(self):
+    def compute_simplify(self):
         if (
             not self.then.has_syntax(C_hole())
             and not self.then.has_syntax(G_hole())
@@ -199,8 +287,8 @@ class If(Instruction):
         return If(self.cond.simplify(), self.then.simplify(), self.else_.simplify())
 
 
-@dataclass
 class Skip(Instruction):
+    __slots__ = ()
 
     def __str__(self) -> str:
         return "pass"
@@ -208,15 +296,13 @@ class Skip(Instruction):
     def __repr__(self) -> str:
         return "Skip()"
 
-    @property
-    def cost(self) -> int:
+    def compute_cost(self) -> int:
         return 1
 
-    @property
-    def depth(self) -> int:
+    def compute_depth(self) -> int:
         return 1
 
-    def terminal(self) -> bool:
+    def compute_terminal(self) -> bool:
         return True
 
     def has_syntax(self, syntax) -> bool:
@@ -225,18 +311,18 @@ class Skip(Instruction):
     def continued(self, syntax) -> bool:
         return isinstance(syntax, Skip)
 
-    def simplify(self):
+    def compute_simplify(self):
         return Skip()
 
 
 ######### Gates #########
 class Gate(Instruction):
-    pass
+    __slots__ = ()
 
 
-@dataclass
 class H(Gate):
-    qreg: Aexp = None
+    qreg: Aexp
+    __slots__ = ("qreg",)
 
     def __str__(self) -> str:
         return f"qc.append(cirq.H(qbits[{str(self.qreg)}]))"
@@ -244,15 +330,13 @@ class H(Gate):
     def __repr__(self) -> str:
         return f"H({self.qreg})"
 
-    @property
-    def cost(self) -> int:
+    def compute_cost(self) -> int:
         return 2 + self.qreg.cost
 
-    @property
-    def depth(self) -> int:
+    def compute_depth(self) -> int:
         return 1 + self.qreg.depth
 
-    def terminal(self) -> bool:
+    def compute_terminal(self) -> bool:
         return self.qreg.terminal()
 
     def has_syntax(self, syntax) -> bool:
@@ -265,13 +349,13 @@ class H(Gate):
             return self.qreg.continued(syntax.qreg)
         return False
 
-    def simplify(self):
+    def compute_simplify(self):
         return H(self.qreg.simplify())
 
 
-@dataclass
 class X(Gate):
-    qreg: Aexp = None
+    qreg: Aexp
+    __slots__ = ("qreg",)
 
     def __str__(self) -> str:
         return f"qc.append(cirq.X(qbits[{str(self.qreg)}]))"
@@ -279,15 +363,13 @@ class X(Gate):
     def __repr__(self) -> str:
         return f"X({self.qreg})"
 
-    @property
-    def cost(self) -> int:
+    def compute_cost(self) -> int:
         return 2 + self.qreg.cost
 
-    @property
-    def depth(self) -> int:
+    def compute_depth(self) -> int:
         return 1 + self.qreg.depth
 
-    def terminal(self) -> bool:
+    def compute_terminal(self) -> bool:
         return self.qreg.terminal()
 
     def has_syntax(self, syntax) -> bool:
@@ -300,49 +382,45 @@ class X(Gate):
             return self.qreg.continued(syntax.qreg)
         return False
 
-    def simplify(self):
+    def compute_simplify(self):
         return X(self.qreg.simplify())
 
 
-@dataclass
 class Y(Gate):
-    pass
+    __slots__ = ()
 
 
-@dataclass
 class Z(Gate):
-    pass
+    __slots__ = ()
 
 
-@dataclass
 class Ry(Gate):
-    p: Aexp = None
-    q: Aexp = None
-    qreg: Aexp = None
+    p: Aexp
+    q: Aexp
+    qreg: Aexp
+    __slots__ = ("p", "q", "qreg")
 
     def __str__(self) -> str:
         if self.p is None and self.q is None:
             return f"qc.append(cirq.Ry(rads=2*np.arccos(math.sqrt(□)))(qbits[{str(self.qreg)}]))"
         return (
             "qc.append(cirq.Ry(rads=2*np.arccos(math.sqrt("
-            + self.p
+            + str(self.p)
             + "/("
-            + self.q
+            + str(self.q)
             + f"))))(qbits[{str(self.qreg)}]))"
         )
 
     def __repr__(self) -> str:
         return f"Ry({self.p}, {self.q}, {self.qreg})"
 
-    @property
-    def cost(self) -> int:
-        return 2 + self.p.cost + self.q.cost + self.qreg.cost
+    def compute_cost(self) -> int:
+        return 2 + self.qreg.cost
 
-    @property
-    def depth(self) -> int:
-        return 1 + max(self.p.depth, self.q.depth, self.qreg.depth)
+    def compute_depth(self) -> int:
+        return 1 + self.qreg.depth
 
-    def terminal(self) -> bool:
+    def compute_terminal(self) -> bool:
         return self.qreg.terminal()
 
     def has_syntax(self, syntax) -> bool:
@@ -355,14 +433,14 @@ class Ry(Gate):
             return self.qreg.continued(syntax.qreg)
         return False
 
-    def simplify(self):
-        return Ry(self.p.simplify(), self.q.simplify(), self.qreg.simplify())
+    def compute_simplify(self):
+        return Ry(self.p, self.q, self.qreg.simplify())
 
 
-@dataclass
 class CX(Gate):
-    qreg1: Aexp = None
-    qreg2: Aexp = None
+    qreg1: Aexp
+    qreg2: Aexp
+    __slots__ = ("qreg1", "qreg2")
 
     def __str__(self) -> str:
         return f"qc.append(cirq.CX(qbits[{str(self.qreg1)}], qbits[{str(self.qreg2)}]))"
@@ -370,15 +448,13 @@ class CX(Gate):
     def __repr__(self) -> str:
         return f"CX({self.qreg1}, {self.qreg2})"
 
-    @property
-    def cost(self) -> int:
+    def compute_cost(self) -> int:
         return 2 + self.qreg1.cost + self.qreg2.cost
 
-    @property
-    def depth(self) -> int:
+    def compute_depth(self) -> int:
         return 1 + max(self.qreg1.depth, self.qreg2.depth)
 
-    def terminal(self) -> bool:
+    def compute_terminal(self) -> bool:
         return self.qreg1.terminal() and self.qreg2.terminal()
 
     def has_syntax(self, syntax) -> bool:
@@ -393,50 +469,46 @@ class CX(Gate):
             )
         return False
 
-    def simplify(self):
+    def compute_simplify(self):
         return CX(self.qreg1.simplify(), self.qreg2.simplify())
 
 
-@dataclass
 class CY(Gate):
-    pass
+    __slots__ = ()
 
 
-@dataclass
 class CZ(Gate):
-    pass
+    __slots__ = ()
 
 
-@dataclass
 class CRy(Gate):
-    p: Aexp = None
-    q: Aexp = None
-    qreg1: Aexp = None
-    qreg2: Aexp = None
+    p: Aexp
+    q: Aexp
+    qreg1: Aexp
+    qreg2: Aexp
+    __slots__ = ("p", "q", "qreg1", "qreg2")
 
     def __str__(self) -> str:
         if self.p is None and self.q is None:
             return f"qc.append(cirq.Ry(rads=2*np.arccos(math.sqrt(□/□)))).controlled(num_controls=1)(qbits[{str(self.qreg1)}],qbits[{str(self.qreg2)}]))"
         return (
             "qc.append(cirq.Ry(rads=2*np.arccos(math.sqrt("
-            + self.p
+            + str(self.p)
             + "/("
-            + self.q
+            + str(self.q)
             + f")))).controlled(num_controls=1)(qbits[{str(self.qreg1)}],qbits[{str(self.qreg2)}]))"
         )
 
     def __repr__(self) -> str:
         return f"CRy({self.p}, {self.q}, {self.qreg1}, {self.qreg2})"
 
-    @property
-    def cost(self) -> int:
+    def compute_cost(self) -> int:
         return 2 + self.qreg1.cost + self.qreg2.cost
 
-    @property
-    def depth(self) -> int:
+    def compute_depth(self) -> int:
         return 1 + max(self.qreg1.depth, self.qreg2.depth)
 
-    def terminal(self) -> bool:
+    def compute_terminal(self) -> bool:
         return self.qreg1.terminal() and self.qreg2.terminal()
 
     def has_syntax(self, syntax) -> bool:
@@ -451,19 +523,19 @@ class CRy(Gate):
             )
         return False
 
-    def simplify(self):
+    def compute_simplify(self):
         return CRy(self.p, self.q, self.qreg1.simplify(), self.qreg2.simplify())
 
 
 ######### Aexp #########
-class Aexp:
-    pass
+class Aexp(Node):
+    __slots__ = ()
 
 
-@dataclass
 class Add(Aexp):
-    left: Aexp = None
-    right: Aexp = None
+    left: Aexp
+    right: Aexp
+    __slots__ = ("left", "right")
 
     def __str__(self) -> str:
         return f"({str(self.left)} + {str(self.right)})"
@@ -471,15 +543,13 @@ class Add(Aexp):
     def __repr__(self) -> str:
         return f"Add({self.left}, {self.right})"
 
-    @property
-    def cost(self) -> int:
+    def compute_cost(self) -> int:
         return 3 + self.left.cost + self.right.cost
 
-    @property
-    def depth(self) -> int:
+    def compute_depth(self) -> int:
         return 1 + max(self.left.depth, self.right.depth)
 
-    def terminal(self) -> bool:
+    def compute_terminal(self) -> bool:
         return self.left.terminal() and self.right.terminal()
 
     def has_syntax(self, syntax) -> bool:
@@ -494,7 +564,7 @@ class Add(Aexp):
             )
         return False
 
-    def simplify(self):
+    def compute_simplify(self):
         if self.left == Integer(0):
             return self.right.simplify()
         elif self.right == Integer(0):
@@ -503,10 +573,10 @@ class Add(Aexp):
             return Add(self.left.simplify(), self.right.simplify())
 
 
-@dataclass
 class Sub(Aexp):
-    left: Aexp = None
-    right: Aexp = None
+    left: Aexp
+    right: Aexp
+    __slots__ = ("left", "right")
 
     def __str__(self) -> str:
         return f"({str(self.left)} - {str(self.right)})"
@@ -514,15 +584,13 @@ class Sub(Aexp):
     def __repr__(self) -> str:
         return f"Sub({self.left}, {self.right})"
 
-    @property
-    def cost(self) -> int:
+    def compute_cost(self) -> int:
         return 3 + self.left.cost + self.right.cost
 
-    @property
-    def depth(self) -> int:
+    def compute_depth(self) -> int:
         return 1 + max(self.left.depth, self.right.depth)
 
-    def terminal(self) -> bool:
+    def compute_terminal(self) -> bool:
         return self.left.terminal() and self.right.terminal()
 
     def has_syntax(self, syntax) -> bool:
@@ -537,7 +605,7 @@ class Sub(Aexp):
             )
         return False
 
-    def simplify(self):
+    def compute_simplify(self):
         if self.right == Integer(0):
             return self.left.simplify()
         elif not isinstance(self.left, Hole) and self.left == self.right:
@@ -546,10 +614,10 @@ class Sub(Aexp):
             return Sub(self.left.simplify(), self.right.simplify())
 
 
-@dataclass
 class Div(Aexp):
-    left: Aexp = None
-    right: Aexp = None
+    left: Aexp
+    right: Aexp
+    __slots__ = ("left", "right")
 
     def __str__(self) -> str:
         return f"({str(self.left)} // {str(self.right)})"
@@ -557,15 +625,13 @@ class Div(Aexp):
     def __repr__(self) -> str:
         return f"Div({self.left}, {self.right})"
 
-    @property
-    def cost(self) -> int:
+    def compute_cost(self) -> int:
         return 3 + self.left.cost + self.right.cost
 
-    @property
-    def depth(self) -> int:
+    def compute_depth(self) -> int:
         return 1 + max(self.left.depth, self.right.depth)
 
-    def terminal(self) -> bool:
+    def compute_terminal(self) -> bool:
         return self.left.terminal() and self.right.terminal()
 
     def has_syntax(self, syntax) -> bool:
@@ -580,7 +646,7 @@ class Div(Aexp):
             )
         return False
 
-    def simplify(self):
+    def compute_simplify(self):
         if self.right == Integer(0):
             raise ZeroDivisionError
         elif self.right == Integer(1):
@@ -593,10 +659,10 @@ class Div(Aexp):
             return Div(self.left.simplify(), self.right.simplify())
 
 
-@dataclass
 class Mul(Aexp):
-    left: Aexp = None
-    right: Aexp = None
+    left: Aexp
+    right: Aexp
+    __slots__ = ("left", "right")
 
     def __str__(self) -> str:
         return f"({str(self.left)} * {str(self.right)})"
@@ -604,15 +670,13 @@ class Mul(Aexp):
     def __repr__(self) -> str:
         return f"Mul({self.left}, {self.right})"
 
-    @property
-    def cost(self) -> int:
+    def compute_cost(self) -> int:
         return 3 + self.left.cost + self.right.cost
 
-    @property
-    def depth(self) -> int:
+    def compute_depth(self) -> int:
         return 1 + max(self.left.depth, self.right.depth)
 
-    def terminal(self) -> bool:
+    def compute_terminal(self) -> bool:
         return self.left.terminal() and self.right.terminal()
 
     def has_syntax(self, syntax) -> bool:
@@ -627,7 +691,7 @@ class Mul(Aexp):
             )
         return False
 
-    def simplify(self):
+    def compute_simplify(self):
         if self.left == Integer(1):
             return self.right.simplify()
         elif self.right == Integer(1):
@@ -639,14 +703,14 @@ class Mul(Aexp):
 
 
 ######### Bexp #########
-class Bexp:
-    pass
+class Bexp(Node):
+    __slots__ = ()
 
 
-@dataclass
 class Equal(Bexp):
-    left: Aexp = None
-    right: Aexp = None
+    left: Aexp
+    right: Aexp
+    __slots__ = ("left", "right")
 
     def __str__(self) -> str:
         return f"({str(self.left)} == {str(self.right)})"
@@ -654,15 +718,13 @@ class Equal(Bexp):
     def __repr__(self) -> str:
         return f"Equal({self.left}, {self.right})"
 
-    @property
-    def cost(self) -> int:
+    def compute_cost(self) -> int:
         return 3 + self.left.cost + self.right.cost
 
-    @property
-    def depth(self) -> int:
+    def compute_depth(self) -> int:
         return 1 + max(self.left.depth, self.right.depth)
 
-    def terminal(self) -> bool:
+    def compute_terminal(self) -> bool:
         return self.left.terminal() and self.right.terminal()
 
     def has_syntax(self, syntax) -> bool:
@@ -677,17 +739,17 @@ class Equal(Bexp):
             )
         return False
 
-    def simplify(self):
+    def compute_simplify(self):
         if self.left == self.right:
             return Integer(1)
         else:
             return Equal(self.left.simplify(), self.right.simplify())
 
 
-@dataclass
 class NEqual(Bexp):
-    left: Aexp = None
-    right: Aexp = None
+    left: Aexp
+    right: Aexp
+    __slots__ = ("left", "right")
 
     def __str__(self) -> str:
         return f"({str(self.left)} != {str(self.right)})"
@@ -695,15 +757,13 @@ class NEqual(Bexp):
     def __repr__(self) -> str:
         return f"NEqual({self.left}, {self.right})"
 
-    @property
-    def cost(self) -> int:
+    def compute_cost(self) -> int:
         return 3 + self.left.cost + self.right.cost
 
-    @property
-    def depth(self) -> int:
+    def compute_depth(self) -> int:
         return 1 + max(self.left.depth, self.right.depth)
 
-    def terminal(self) -> bool:
+    def compute_terminal(self) -> bool:
         return self.left.terminal() and self.right.terminal()
 
     def has_syntax(self, syntax) -> bool:
@@ -718,17 +778,17 @@ class NEqual(Bexp):
             )
         return False
 
-    def simplify(self):
+    def compute_simplify(self):
         if self.left == self.right:
             return Integer(0)
         else:
             return NEqual(self.left.simplify(), self.right.simplify())
 
 
-@dataclass
 class Less(Bexp):
-    left: Aexp = None
-    right: Aexp = None
+    left: Aexp
+    right: Aexp
+    __slots__ = ("left", "right")
 
     def __str__(self) -> str:
         return f"({str(self.left)} < {str(self.right)})"
@@ -736,15 +796,13 @@ class Less(Bexp):
     def __repr__(self) -> str:
         return f"Less({self.left}, {self.right})"
 
-    @property
-    def cost(self) -> int:
+    def compute_cost(self) -> int:
         return 3 + self.left.cost + self.right.cost
 
-    @property
-    def depth(self) -> int:
+    def compute_depth(self) -> int:
         return 1 + max(self.left.depth, self.right.depth)
 
-    def terminal(self) -> bool:
+    def compute_terminal(self) -> bool:
         return self.left.terminal() and self.right.terminal()
 
     def has_syntax(self, syntax) -> bool:
@@ -759,17 +817,17 @@ class Less(Bexp):
             )
         return False
 
-    def simplify(self):
+    def compute_simplify(self):
         if self.left == self.right:
             return Integer(0)
         else:
             return Less(self.left.simplify(), self.right.simplify())
 
 
-@dataclass
 class LessEqual(Bexp):
-    left: Aexp = None
-    right: Aexp = None
+    left: Aexp
+    right: Aexp
+    __slots__ = ("left", "right")
 
     def __str__(self) -> str:
         return f"({str(self.left)} <= {str(self.right)})"
@@ -777,15 +835,13 @@ class LessEqual(Bexp):
     def __repr__(self) -> str:
         return f"LessEqual({self.left}, {self.right})"
 
-    @property
-    def cost(self) -> int:
+    def compute_cost(self) -> int:
         return 3 + self.left.cost + self.right.cost
 
-    @property
-    def depth(self) -> int:
+    def compute_depth(self) -> int:
         return 1 + max(self.left.depth, self.right.depth)
 
-    def terminal(self) -> bool:
+    def compute_terminal(self) -> bool:
         return self.left.terminal() and self.right.terminal()
 
     def has_syntax(self, syntax) -> bool:
@@ -800,7 +856,7 @@ class LessEqual(Bexp):
             )
         return False
 
-    def simplify(self):
+    def compute_simplify(self):
         if self.left == self.right:
             return Integer(1)
         else:
@@ -808,9 +864,9 @@ class LessEqual(Bexp):
 
 
 ######### Integer #########
-@dataclass
 class Integer(Aexp):
-    value: int = None
+    value: int
+    __slots__ = ("value",)
 
     def __str__(self) -> str:
         if type(self.value) == int:
@@ -820,17 +876,15 @@ class Integer(Aexp):
     def __repr__(self) -> str:
         return f"Integer({self.value})"
 
-    @property
-    def cost(self) -> int:
+    def compute_cost(self) -> int:
         return 1
 
-    @property
-    def depth(self) -> int:
+    def compute_depth(self) -> int:
         if type(self.value) == int:
             return 2
         return 1 + self.value.depth
 
-    def terminal(self) -> bool:
+    def compute_terminal(self) -> bool:
         if type(self.value) == int:
             return True
         return self.value.terminal()
@@ -847,17 +901,17 @@ class Integer(Aexp):
             return self == syntax
         return False
 
-    def simplify(self):
+    def compute_simplify(self):
         return Integer(self.value)
 
 
 ######### Var #########
 class Var(Aexp):
-    pass
+    __slots__ = ()
 
 
-@dataclass
 class N(Var):
+    __slots__ = ()
 
     def __str__(self) -> str:
         return "n"
@@ -865,15 +919,13 @@ class N(Var):
     def __repr__(self) -> str:
         return "N()"
 
-    @property
-    def cost(self) -> int:
+    def compute_cost(self) -> int:
         return 0
 
-    @property
-    def depth(self) -> int:
+    def compute_depth(self) -> int:
         return 1
 
-    def terminal(self) -> bool:
+    def compute_terminal(self) -> bool:
         return True
 
     def has_syntax(self, syntax) -> bool:
@@ -882,12 +934,12 @@ class N(Var):
     def continued(self, syntax) -> bool:
         return isinstance(syntax, N)
 
-    def simplify(self):
+    def compute_simplify(self):
         return N()
 
 
-@dataclass
 class I(Var):
+    __slots__ = ()
 
     def __str__(self) -> str:
         return "i"
@@ -895,15 +947,13 @@ class I(Var):
     def __repr__(self) -> str:
         return "I()"
 
-    @property
-    def cost(self) -> int:
+    def compute_cost(self) -> int:
         return 0
 
-    @property
-    def depth(self) -> int:
+    def compute_depth(self) -> int:
         return 1
 
-    def terminal(self) -> bool:
+    def compute_terminal(self) -> bool:
         return True
 
     def has_syntax(self, syntax) -> bool:
@@ -912,12 +962,12 @@ class I(Var):
     def continued(self, syntax) -> bool:
         return isinstance(syntax, I)
 
-    def simplify(self):
+    def compute_simplify(self):
         return I()
 
 
-@dataclass
 class J(Var):
+    __slots__ = ()
 
     def __str__(self) -> str:
         return "j"
@@ -925,15 +975,13 @@ class J(Var):
     def __repr__(self) -> str:
         return "J()"
 
-    @property
-    def cost(self) -> int:
+    def compute_cost(self) -> int:
         return 0
 
-    @property
-    def depth(self) -> int:
+    def compute_depth(self) -> int:
         return 1
 
-    def terminal(self) -> bool:
+    def compute_terminal(self) -> bool:
         return True
 
     def has_syntax(self, syntax) -> bool:
@@ -942,13 +990,13 @@ class J(Var):
     def continued(self, syntax) -> bool:
         return isinstance(syntax, J)
 
-    def simplify(self):
+    def compute_simplify(self):
         return J()
 
 
-@dataclass
 class Bit(Var):
-    index: Var = None
+    index: Var
+    __slots__ = ("index",)
 
     def __str__(self) -> str:
         if self.index is None:
@@ -960,19 +1008,17 @@ class Bit(Var):
             return "Bit()"
         return f"Bit({self.index})"
 
-    @property
-    def cost(self) -> int:
+    def compute_cost(self) -> int:
         if self.index is None:
             return 0
         return self.index.cost
 
-    @property
-    def depth(self) -> int:
+    def compute_depth(self) -> int:
         if self.index is None:
             return 1
         return 1 + self.index.depth
 
-    def terminal(self) -> bool:
+    def compute_terminal(self) -> bool:
         if self.index is None:
             return True
         return self.index.terminal()
@@ -987,19 +1033,19 @@ class Bit(Var):
             return self.index.continued(syntax.index)
         return False
 
-    def simplify(self):
+    def compute_simplify(self):
         if self.index is None:
             return Bit()
         return Bit(self.index.simplify())
 
 
 ######### Hole #########
-class Hole:
-    pass
+class Hole(Node):
+    __slots__ = ()
 
 
-@dataclass
 class C_hole(Instruction, Hole):
+    __slots__ = ()
 
     def __str__(self) -> str:
         return "□_c"
@@ -1007,15 +1053,13 @@ class C_hole(Instruction, Hole):
     def __repr__(self) -> str:
         return "C_hole()"
 
-    @property
-    def cost(self) -> int:
+    def compute_cost(self) -> int:
         return 5
 
-    @property
-    def depth(self) -> int:
+    def compute_depth(self) -> int:
         return 1
 
-    def terminal(self) -> bool:
+    def compute_terminal(self) -> bool:
         return False
 
     def has_syntax(self, syntax) -> bool:
@@ -1024,12 +1068,12 @@ class C_hole(Instruction, Hole):
     def continued(self, syntax) -> bool:
         return isinstance(syntax, Instruction)
 
-    def simplify(self):
+    def compute_simplify(self):
         return C_hole()
 
 
-@dataclass
 class G_hole(Gate, Hole):
+    __slots__ = ()
 
     def __str__(self) -> str:
         return "□_g"
@@ -1037,15 +1081,13 @@ class G_hole(Gate, Hole):
     def __repr__(self) -> str:
         return "G_hole()"
 
-    @property
-    def cost(self) -> int:
+    def compute_cost(self) -> int:
         return 3
 
-    @property
-    def depth(self) -> int:
+    def compute_depth(self) -> int:
         return 1
 
-    def terminal(self) -> bool:
+    def compute_terminal(self) -> bool:
         return False
 
     def has_syntax(self, syntax) -> bool:
@@ -1054,12 +1096,12 @@ class G_hole(Gate, Hole):
     def continued(self, syntax) -> bool:
         return isinstance(syntax, Gate)
 
-    def simplify(self):
+    def compute_simplify(self):
         return G_hole()
 
 
-@dataclass
 class A_hole(Aexp, Hole):
+    __slots__ = ()
 
     def __str__(self) -> str:
         return "□_a"
@@ -1067,15 +1109,13 @@ class A_hole(Aexp, Hole):
     def __repr__(self) -> str:
         return "A_hole()"
 
-    @property
-    def cost(self) -> int:
+    def compute_cost(self) -> int:
         return 3
 
-    @property
-    def depth(self) -> int:
+    def compute_depth(self) -> int:
         return 1
 
-    def terminal(self) -> bool:
+    def compute_terminal(self) -> bool:
         return False
 
     def has_syntax(self, syntax) -> bool:
@@ -1084,12 +1124,12 @@ class A_hole(Aexp, Hole):
     def continued(self, syntax) -> bool:
         return isinstance(syntax, Aexp)
 
-    def simplify(self):
+    def compute_simplify(self):
         return A_hole()
 
 
-@dataclass
 class B_hole(Bit, Hole):
+    __slots__ = ()
 
     def __str__(self) -> str:
         return "□_b"
@@ -1097,15 +1137,13 @@ class B_hole(Bit, Hole):
     def __repr__(self) -> str:
         return "B_hole()"
 
-    @property
-    def cost(self) -> int:
+    def compute_cost(self) -> int:
         return 3
 
-    @property
-    def depth(self) -> int:
+    def compute_depth(self) -> int:
         return 1
 
-    def terminal(self) -> bool:
+    def compute_terminal(self) -> bool:
         return False
 
     def has_syntax(self, syntax) -> bool:
@@ -1114,12 +1152,12 @@ class B_hole(Bit, Hole):
     def continued(self, syntax) -> bool:
         return isinstance(syntax, Bit)
 
-    def simplify(self):
+    def compute_simplify(self):
         return B_hole()
 
 
-@dataclass
 class V_hole(Var, Hole):
+    __slots__ = ()
 
     def __str__(self) -> str:
         return "□_v"
@@ -1127,15 +1165,13 @@ class V_hole(Var, Hole):
     def __repr__(self) -> str:
         return "V_hole()"
 
-    @property
-    def cost(self) -> int:
+    def compute_cost(self) -> int:
         return 3
 
-    @property
-    def depth(self) -> int:
+    def compute_depth(self) -> int:
         return 1
 
-    def terminal(self) -> bool:
+    def compute_terminal(self) -> bool:
         return False
 
     def has_syntax(self, syntax) -> bool:
@@ -1144,12 +1180,12 @@ class V_hole(Var, Hole):
     def continued(self, syntax) -> bool:
         return isinstance(syntax, Var)
 
-    def simplify(self):
+    def compute_simplify(self):
         return V_hole()
 
 
-@dataclass
 class Z_hole(Integer, Hole):
+    __slots__ = ()
 
     def __str__(self) -> str:
         return "□_i"
@@ -1157,15 +1193,13 @@ class Z_hole(Integer, Hole):
     def __repr__(self) -> str:
         return "Z_hole()"
 
-    @property
-    def cost(self) -> int:
+    def compute_cost(self) -> int:
         return 3
 
-    @property
-    def depth(self) -> int:
+    def compute_depth(self) -> int:
         return 1
 
-    def terminal(self) -> bool:
+    def compute_terminal(self) -> bool:
         return False
 
     def has_syntax(self, syntax) -> bool:
@@ -1174,5 +1208,5 @@ class Z_hole(Integer, Hole):
     def continued(self, syntax) -> bool:
         return isinstance(syntax, Integer)
 
-    def simplify(self):
+    def compute_simplify(self):
         return Z_hole()
@@ -1,160 +1,155 @@
-from typing import Union
+from typing import NamedTuple, Union
 
 from synthesizer.language import *
 
 transition_debug = False
 
 
-def prune_basic(target: Pgm) -> bool:
-    lst_count, for_count, if_count, aexp_count = [0] * 4
+class Tally(NamedTuple):
+    # node counts of a subtree and the first rule it breaks (None if none)
+    lst_count: int
+    for_count: int
+    if_count: int
+    aexp_count: int
+    reason: str
 
-    def program_case(target: Pgm):
-        return cases[type(target.inst)](target.inst)
 
-    def lst_case(target: Seq):
-        nonlocal lst_count
-        lst_count += 1
-        if lst_count > 3:
-            if transition_debug:
-                print("lst count")
-            return True
-        return cases[type(target.left)](target.left) or cases[type(target.right)](
-            target.right
-        )
-
-    def if_case(target: If):
-        nonlocal if_count
-        if_count += 1
-        if if_count > 3:
-            if transition_debug:
-                print("if count")
-            return True
-        return (
-            cases[type(target.cond)](target.cond)
-            or cases[type(target.then)](target.then)
-            or cases[type(target.else_)](target.else_)
-        )
-
-    def for_case(target: For):
-        nonlocal for_count
-        for_count += 1
-        if for_count > 1:  # for loop 한 번으로 제한
-            if transition_debug:
-                print("for count")
-            return True
-        if target.body.terminal() and not target.body.has_syntax(
-            I()
-        ):  # for loop 내부에 hole 없으면서, I 없는 경우
-            return True
-        return (
-            cases[type(target.var)](target.var)
-            or cases[type(target.start)](target.start)
-            or cases[type(target.end)](target.end)
-            or cases[type(target.body)](target.body)
-        )
-
-    def single_gate(target: Union[H, X, Ry]):
-        return cases[type(target.qreg)](target.qreg)
-
-    def controlled_gate(target: Union[CX, CRy]):
-        return cases[type(target.qreg1)](target.qreg1) or cases[type(target.qreg2)](
-            target.qreg2
-        )
-
-    def aexp_case(target: Union[Div, Mul, Add, Sub]):
-        nonlocal aexp_count
-        aexp_count += 1
-        if aexp_count > 11:
-            if transition_debug:
-                print("aexp count")  # aexp 깊이 제한
-            return True
-        # aexp에 N, I, A_hole 사용 강제
-        if not isinstance(target.left, Hole) and target.left == target.right:
-            if transition_debug:
-                print("left == right")  # left, right 같음
-            return True
-        res = False
-        if isinstance(target, Div):
-            res = res or div_case(target)
-        if isinstance(target, Mul):
-            res = res or mul_case(target)
-        if isinstance(target, Sub):
-            res = res or sub_case(target)
-        if isinstance(target, Add):
-            res = res or add_case(target)
-        return res
-
-    def div_case(target: Div):
-        nonlocal aexp_count
-        if isinstance(target.left, Div) or isinstance(target.right, Div):
-            if transition_debug:
-                print("same op in op")
-            return True
-        return cases[type(target.left)](target.left) or cases[type(target.right)](
-            target.right
-        )
+empty = Tally(0, 0, 0, 0, None)
 
-    def mul_case(target: Mul):
-        nonlocal aexp_count
-        if not isinstance(target.left, Hole) and (target.left == target.right):
-            if transition_debug:
-                print("left == right")  # left, right 같음
-            return True
-        if isinstance(target.left, Mul) or isinstance(target.right, Mul):
-            if transition_debug:
-                print("same op in op")
-            return True
-        return cases[type(target.left)](target.left) or cases[type(target.right)](
-            target.right
-        )
 
-    def sub_case(target: Sub):
-        nonlocal aexp_count
-        if isinstance(target.left, Sub) or isinstance(target.right, Sub):
-            if transition_debug:
-                print("same op in op")
-            return True
-        return cases[type(target.left)](target.left) or cases[type(target.right)](
-            target.right
+def tally(target: Node) -> Tally:
+    # cached on the interned node: a child shares every subtree of its parent
+    # except the spine to the filled hole, so only the new spine nodes are
+    # tallied
+    res = target._tally
+    if res is None:
+        res = cases[type(target)](target)
+        object.__setattr__(target, "_tally", res)
+    return res
+
+
+def combine(children, lst_count=0, for_count=0, if_count=0, aexp_count=0, reason=None):
+    # the node's own counts plus those of its children
+    for child in children:
+        res = tally(child)
+        lst_count += res.lst_count
+        for_count += res.for_count
+        if_count += res.if_count
+        aexp_count += res.aexp_count
+        reason = reason or res.reason
+    if reason is None:
+        reason = limit_reason(lst_count, for_count, if_count, aexp_count)
+    return Tally(lst_count, for_count, if_count, aexp_count, reason)
+
+
+def limit_reason(lst_count: int, for_count: int, if_count: int, aexp_count: int) -> str:
+    if lst_count > 3:
+        return "lst count"
+    if if_count > 3:
+        return "if count"
+    if for_count > 1:  # for loop 한 번으로 제한
+        return "for count"
+    if aexp_count > 11:
+        return "aexp count"  # aexp 깊이 제한
+    return None
+
+
+def program_case(target: Pgm) -> Tally:
+    return combine([target.inst])
+
+
+def lst_case(target: Seq) -> Tally:
+    return combine([target.left, target.right], lst_count=1)
+
+
+def if_case(target: If) -> Tally:
+    return combine([target.cond, target.then, target.else_], if_count=1)
+
+
+def for_case(target: For) -> Tally:
+    reason = None
+    if target.body.terminal() and not target.body.has_syntax(
+        I()
+    ):  # for loop 내부에 hole 없으면서, I 없는 경우
+        reason = "no i in for"
+    children = [target.var, target.start, target.end, target.body]
+    return combine(children, for_count=1, reason=reason)
+
+
+def single_gate(target: Union[H, X, Ry]) -> Tally:
+    return combine([target.qreg])
+
+
+def controlled_gate(target: Union[CX, CRy]) -> Tally:
+    return combine([target.qreg1, target.qreg2])
+
+
+def aexp_case(target: Union[Div, Mul, Add, Sub]) -> Tally:
+    # aexp에 N, I, A_hole 사용 강제
+    reason = None
+    if not isinstance(target.left, Hole) and target.left == target.right:
+        reason = "left == right"  # left, right 같음
+    elif isinstance(target, (Div, Mul, Sub)) and (
+        isinstance(target.left, type(target)) or isinstance(target.right, type(target))
+    ):
+        reason = "same op in op"
+    return combine([target.left, target.right], aexp_count=1, reason=reason)
+
+
+def false_case(target: Union[Integer, Skip, Var, Hole]) -> Tally:
+    return empty
+
+
+cases = {
+    Pgm: program_case,
+    Seq: lst_case,
+    If: if_case,
+    For: for_case,
+    H: single_gate,
+    X: single_gate,
+    Ry: single_gate,
+    CX: controlled_gate,
+    CRy: controlled_gate,
+    Div: aexp_case,
+    Mul: aexp_case,
+    Sub: aexp_case,
+    Add: aexp_case,
+    Bit: false_case,
+    Integer: false_case,
+    Skip: false_case,
+    I: false_case,
+    J: false_case,
+    N: false_case,
+    C_hole: false_case,
+    G_hole: false_case,
+    A_hole: false_case,
+    V_hole: false_case,
+    Z_hole: false_case,
+}
+
+
+def prune_basic(target: Node) -> bool:
+    # O(1) for a node built from checked subtrees: its tally is combined from
+    # the cached tallies of its children. Also applies to subtrees, since a
+    # subtree that breaks a rule makes every program containing it break it
+    reason = tally(target).reason
+    if reason is not None and transition_debug:
+        print(reason)
+    return reason is not None
+
+
+def prune_fill(context: Tally, filler: Node) -> bool:
+    # whether filling a hole of a program with tally context by filler breaks
+    # a count limit, before any ancestor is rebuilt (holes count for nothing)
+    res = tally(filler)
+    if context.reason is not None or res.reason is not None:
+        return True
+    return (
+        limit_reason(
+            context.lst_count + res.lst_count,
+            context.for_count + res.for_count,
+            context.if_count + res.if_count,
+            context.aexp_count + res.aexp_count,
         )
-
-    def add_case(target: Add):
-        nonlocal aexp_count
-        if not isinstance(target.left, Hole) and (target.left == target.right):
-            if transition_debug:
-                print("left == right")  # left, right 같음
-            return True
-        return cases[type(target.left)](target.left) or cases[type(target.right)](
-            target.right
-        )
-
-    def false_case(target: Union[Integer, Skip, Var, Hole]):
-        return False
-
-    cases = {
-        Pgm: program_case,
-        Seq: lst_case,
-        If: if_case,
-        For: for_case,
-        H: single_gate,
-        X: single_gate,
-        Ry: single_gate,
-        CX: controlled_gate,
-        CRy: controlled_gate,
-        Div: aexp_case,
-        Mul: aexp_case,
-        Sub: aexp_case,
-        Add: aexp_case,
-        Bit: false_case,
-        Integer: false_case,
-        Skip: false_case,
-        I: false_case,
-        J: false_case,
-        N: false_case,
-        C_hole: false_case,
-        G_hole: false_case,
-        A_hole: false_case,
-        V_hole: false_case,
-        Z_hole: false_case,
-    }
-    return cases[type(target)](target)
+        is not None
+    )
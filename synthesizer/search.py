@@ -1,54 +1,1018 @@
-import copy, time
+import bisect, functools, hashlib, heapq, itertools, math, multiprocessing, os, queue, time
+import numpy as np
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait
+from typing import List, NamedTuple
 
-from synthesizer.language import Pgm, C_hole, Ry, CRy
-from synthesizer.worklist import Worklist
+from synthesizer.language import *
+from synthesizer.worklist import (
+    SpillingWorklist,
+    Worklist,
+    fingerprint as worklist_fingerprint,
+)
 from synthesizer.prune import prune_basic
-from synthesizer.setup import get_spec, verify
-from synthesizer.transition import next, fill_theta
+from synthesizer.setup import (
+    get_spec,
+    group_spec,
+    run_batch,
+    check_batch,
+)
+from synthesizer.simulator import (
+    PrefixCache,
+    flatten,
+    permutation_fidelity,
+    program_variables,
+    simulate,
+)
+from synthesizer.equivalence import ObservationalEquivalence, fingerprint, sequence
+from synthesizer.compiler import evaluate, lower
+from synthesizer.angles import Unrunnable, near_theta, solve_angles, solve_theta
+from synthesizer.checkpoint import load_checkpoint, save_checkpoint, spec_digest
+from synthesizer.budget import (
+    RSS_INTERVAL,
+    Budget,
+    BudgetExceeded,
+    Incumbent,
+    Meter,
+    Result,
+)
+from synthesizer.transition import (
+    next,
+    loop_vars,
+    theta_options,
+)
 
-def search_base(filename: str) -> Pgm:
-    worklist = Worklist()
-    worklist.put([Pgm(C_hole())])
+def examine(
+    target: Pgm,
+    groups,
+    cache: PrefixCache,
+    equivalence: ObservationalEquivalence = None,
+    verbose: bool = False,
+    incumbent: Incumbent = None,
+    meter: Meter = None,
+):
+    # what popping target yields: the program it solves every example with
+    # (None if none), and whether target still has holes to expand. Complete
+    # candidates run on the examples are shown to incumbent, if given, and
+    # counted as verifications of meter, whose budget is checked every CHECK
+    # of them: a candidate's angle assignments can take long. Raises
+    # BudgetExceeded when it runs out
+
+    def run(prog: Pgm) -> List[np.ndarray]:
+        if meter is not None:
+            meter.verifications += 1
+            if meter.verifications % CHECK == 0:
+                reason = meter.exhausted()
+                if reason is not None:
+                    raise BudgetExceeded(reason)
+        return run_batch(prog, groups, cache)
+
+    if target.terminal() and not (
+        target.has_syntax(Ry()) or target.has_syntax(CRy())
+    ):
+        states = run(target)
+        if equivalence is not None and equivalence.seen_outputs(states):
+            return None, False
+        solution = check_batch(states, groups)
+        if incumbent is not None:
+            incumbent.observe(target, states, solution)
+        if verbose:
+            for i in range(len(solution)):
+                if not solution[i]:
+                    break
+                print(f"Solution matches {i+1}th spec: {target}")
+        return (target if all(solution) else None), False
+    if equivalence is not None and equivalence.seen_prefix(target, groups, cache):
+        return None, False
+    if not target.terminal():
+        return None, True
+    try:
+        samples, reached = solve_angles(target, groups)
+    except Unrunnable:
+        return None, False  # fails on some example for every choice of angles
+
+    def passes(prog: Pgm) -> bool:
+        states = run(prog)
+        solution = check_batch(states, groups)
+        if incumbent is not None:
+            incumbent.observe(prog, states, solution)
+        return all(solution)
+
+    prog = solve_theta(target, samples) if reached else None
+    if prog is None or not passes(prog):
+        # the optimizer missed an output, or the angles it found have no
+        # integer linear ratio: try the assignments nearest to those angles,
+        # each one checked on every example. The optimizer is a local search,
+        # so rejecting the candidate after them may lose a solution
+        for prog in near_theta(target, samples, [group.n for group in groups]):
+            if passes(prog):
+                break
+        else:
+            return None, False
+    if verbose:
+        print(f"Solution matches all specs: {prog}")
+    return prog, False
+
+
+CHECK = 256  # candidates examine runs between budget checks
+PROGRESS = 1000  # pops between progress reports of search_base
+verifier = {}  # specification of the verifier processes, set by init_verifier
+signalled = None  # signal number received by stop_search
+
+
+def stop_search(signum: int, frame):
+    # signal handler: search_base saves its checkpoint before its next pop
+    # and exits with 128 + signum. Exiting from the handler could pickle the
+    # worklist in the middle of an update
+    global signalled
+    signalled = signum
+
+
+def init_verifier(filename: str):
+    _, specification = get_spec(filename)
+    verifier["groups"] = group_spec(specification)
+    verifier["cache"] = PrefixCache()
+
+
+def verify_candidate(target: Pgm):
+    # (solution or None, best candidate tried, examples it passes, fidelity,
+    # candidates run)
+    incumbent, meter = Incumbent(verifier["groups"]), Meter(Budget(wall=None))
+    solution = examine(
+        target,
+        verifier["groups"],
+        verifier["cache"],
+        incumbent=incumbent,
+        meter=meter,
+    )[0]
+    return (
+        solution,
+        incumbent.program,
+        incumbent.passed,
+        incumbent.fidelity,
+        meter.verifications,
+    )
+
+
+class VerificationPipeline:
+    # verifies terminal candidates in a process pool while the search keeps
+    # enumerating. At most depth candidates are pending; results are taken in
+    # submission order, so the solution reported is the first passing
+    # candidate in pop order, the one the sequential loop would return.
+    # Collected candidates are offered to incumbent, and the candidates the
+    # verifiers ran counted as verifications of meter, if given
+    def __init__(
+        self,
+        filename: str,
+        workers: int,
+        depth: int = None,
+        incumbent: Incumbent = None,
+        meter: Meter = None,
+    ):
+        self.pool = ProcessPoolExecutor(
+            workers,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=init_verifier,
+            initargs=(filename,),
+        )
+        self.depth = depth or 4 * workers
+        self.incumbent = incumbent
+        self.meter = meter
+        self.pending = deque()  # (candidate, future) in submission order
+
+    def submit(self, target: Pgm) -> Pgm:
+        # queues target, waiting for the oldest candidate when the queue is
+        # full; returns a solution once every candidate before it failed
+        self.pending.append((target, self.pool.submit(verify_candidate, target)))
+        if len(self.pending) >= self.depth:
+            wait([self.pending[0][1]])
+        return self.collect()
+
+    def collect(self, block: bool = False) -> Pgm:
+        while self.pending and (block or self.pending[0][1].done()):
+            res, program, passed, fidelity, runs = self.pending.popleft()[1].result()
+            if self.meter is not None:
+                self.meter.verifications += runs
+            if self.incumbent is not None:
+                self.incumbent.offer(program, passed, fidelity)
+            if res is not None:
+                return res
+        return None
+
+    def pids(self):
+        # live view of the pool's process ids: the pool starts them on demand
+        return self.pool._processes.keys()
+
+    def targets(self) -> List[Pgm]:
+        # candidates submitted and not collected yet
+        return [target for target, _ in self.pending]
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+def search_base(
+    filename: str,
+    dedup: bool = False,
+    verifiers: int = 0,
+    budget: Budget = None,
+    progress=None,
+    checkpoint: str = None,
+    resume: bool = False,
+    interval: float = 300,
+    resident: int = None,
+) -> Result:
+    # with verifiers > 0, terminal candidates are verified by that many
+    # processes (see VerificationPipeline); output and prefix equivalence
+    # checks then only apply to the programs expanded here. progress, if
+    # given, is called with (loop, worklist size, incumbent) every PROGRESS
+    # pops and may raise to stop the search. With checkpoint, the search state is saved to
+    # that file every interval seconds and when the search stops without a
+    # solution; resume continues from it, with a new budget. With resident,
+    # the worklist keeps about that many programs in memory and spills the
+    # costlier ones to disk
     gates, specification = get_spec(filename)
-    loop = 0
-    complete = 0
-    start = time.time()
+    groups = group_spec(specification)
+    n, bits = specification[0].n, specification[0].bits
+    digest = spec_digest(gates, specification)
+    cache = PrefixCache()
+    if resume:
+        state = load_checkpoint(checkpoint, digest)
+        worklist, loop = state["worklist"], state["loop"]
+        for target in reversed(state["pending"]):  # popped, not finished
+            worklist.push_front(target)
+        equivalence = state["equivalence"]
+        print(f"Resumed at loop {loop} with {worklist.size()} programs")
+    else:
+        worklist = Worklist() if resident is None else SpillingWorklist(resident)
+        loop, equivalence = 0, None
+        worklist.put([Pgm(C_hole())])
+    if not dedup:
+        equivalence = None
+    elif equivalence is None:
+        equivalence = ObservationalEquivalence()
+    meter, incumbent = Meter(budget), Incumbent(groups)
+    pipeline = None
+    if verifiers > 0:
+        pipeline = VerificationPipeline(
+            filename, verifiers, incumbent=incumbent, meter=meter
+        )
+        meter.pids = pipeline.pids()
+    current = target = reason = None  # current: popped and not finished
+    saved = time.time()
+
+    def save():
+        nonlocal saved
+        pending = pipeline.targets() if pipeline is not None else []
+        if current is not None:
+            pending.insert(0, current)
+        save_checkpoint(
+            checkpoint,
+            {
+                "spec": digest,
+                "worklist": worklist,
+                "loop": loop,
+                "equivalence": equivalence,
+                "pending": pending,
+            },
+        )
+        saved = time.time()
+
     try:
-        while worklist.notEmpty() and time.time() - start < 3600:
+        while worklist.notEmpty():
+            if signalled is not None:
+                raise SystemExit(128 + signalled)
+            reason = meter.exhausted()
+            if reason is not None:
+                break
+            if checkpoint is not None and time.time() - saved >= interval:
+                save()
             loop += 1
-            target = worklist.get()
-            spec = copy.deepcopy(specification)
-            solution = [False] * len(spec)
-            if not prune_basic(target):
-                for i in range(len(spec)):
-                    if target.terminal():
-                        complete += 1
-                        if target.has_syntax(Ry()) or target.has_syntax(CRy()):
-                            for prog in fill_theta(spec[i].n, target, 0):
-                                target = prog
-                                if verify(target, spec[i]):
-                                    solution[i] = True
-                                    print(f"Solution matches {i+1}th spec: {prog}")
-                                    break
-                            if all(solution):
-                                print(f"loop: {loop}")
-                                print(f"worklist size: {worklist.current_set.qsize()}")
-                                return target
-                        if verify(target, spec[i]):
-                            solution[i] = True
-                            print(f"Solution matches {i+1}th spec: {target}")
-                        else:
-                            break
-                        if all(solution):
-                            print(f"loop: {loop}")
-                            print(f"worklist size: {worklist.current_set.qsize()}")
-                            return target
-                    else:
-                        for i in next(target, spec[i].n, spec[i].bits, gates):
-                            worklist.put([i])
-                        break
-        raise Exception(f"Worklist empty or timeout. Loop: {loop}")
+            if progress is not None and loop % PROGRESS == 0:
+                progress(loop, worklist.size(), incumbent)
+            current = target = worklist.get()
+            meter.count()
+            if pipeline is not None and target.terminal():
+                solution, expand = pipeline.submit(target), False
+            else:
+                try:
+                    solution, expand = examine(
+                        target, groups, cache, equivalence, True, incumbent, meter
+                    )
+                except BudgetExceeded as e:
+                    reason = e.reason  # target stays pending in checkpoints
+                    break
+            if solution is not None:
+                print(f"loop: {loop}")
+                print(f"worklist size: {worklist.size()}")
+                return meter.result(incumbent, solution, worklist=worklist.size())
+            if expand:
+                worklist.put(next(target, n, bits, gates))
+            current = None
+        if pipeline is not None:
+            solution = pipeline.collect(block=True)
+            if solution is not None:
+                print(f"loop: {loop}")
+                return meter.result(incumbent, solution, worklist=worklist.size())
+        if checkpoint is not None:
+            save()
+        return meter.result(
+            incumbent, reason=reason or "exhausted", worklist=worklist.size()
+        )
+    except (KeyboardInterrupt, SystemExit):
+        if checkpoint is not None:
+            save()
+            print(f"Checkpoint saved to {checkpoint} at loop {loop}")
+        raise
     except Exception as e:
         print(f"exception loop {loop}:{target}\n" + "\033[95m" + f"{str(target)}" + "\033[0m" + "\n-------------------")
-        print(f"worklist size: {worklist.current_set.qsize()}")
+        print(f"worklist size: {worklist.size()}")
         raise e
+    finally:
+        if pipeline is not None:
+            pipeline.close()
+
+
+def search_beam(
+    filename: str,
+    width: int = 1000,
+    score=None,
+    dedup: bool = False,
+    budget: Budget = None,
+) -> Result:
+    # search_base where every cost level examines at most width programs.
+    # Within a level programs are ranked by score(program) when given, then
+    # depth and generation order (search_base's order without score); once a
+    # level is full, a new program replaces the worst pending one if it ranks
+    # better and is dropped otherwise. Memory and time are bounded by width
+    # per cost level, plus a 16-byte digest per program generated.
+    # Incomplete: a solution is missed when one of its partial programs is
+    # dropped
+    gates, specification = get_spec(filename)
+    groups = group_spec(specification)
+    n, bits = specification[0].n, specification[0].bits
+    cache = PrefixCache()
+    equivalence = ObservationalEquivalence() if dedup else None
+    levels = {}  # cost -> pending (rank, count, program), best first
+    examined = {}  # cost -> programs popped
+    costs = []  # heap of the costs with pending programs
+    seen = set()
+    generated = 0
+
+    def push(target: Pgm):
+        nonlocal generated
+        key = worklist_fingerprint(target)
+        if key in seen:
+            return
+        seen.add(key)  # a dropped program would be dropped again
+        generated += 1
+        entry = ((0 if score is None else score(target), target.depth), generated, target)
+        cost = target.cost
+        pending = levels.get(cost, [])
+        if examined.get(cost, 0) + len(pending) >= width:
+            if not pending or entry >= pending[-1]:
+                return
+            pending.pop()
+        elif cost not in levels:
+            levels[cost] = pending
+            heapq.heappush(costs, cost)
+        bisect.insort(pending, entry)
+
+    def pop() -> Pgm:
+        cost = costs[0]
+        pending = levels[cost]
+        target = pending.pop(0)[2]
+        examined[cost] = examined.get(cost, 0) + 1
+        if not pending:
+            del levels[cost]
+            heapq.heappop(costs)
+        return target
+
+    push(Pgm(C_hole()))
+    meter, incumbent = Meter(budget), Incumbent(groups)
+    loop, reason = 0, None
+    while costs:
+        reason = meter.exhausted()
+        if reason is not None:
+            break
+        loop += 1
+        target = pop()
+        meter.count()
+        try:
+            solution, expand = examine(
+                target, groups, cache, equivalence, incumbent=incumbent, meter=meter
+            )
+        except BudgetExceeded as e:
+            reason = e.reason
+            break
+        if solution is not None:
+            print(f"loop: {loop}")
+            print(f"cost levels: {len(examined)}")
+            return meter.result(incumbent, solution, levels=len(examined))
+        if expand:
+            for child in next(target, n, bits, gates):
+                push(child)
+    return meter.result(incumbent, reason=reason or "exhausted", levels=len(examined))
+
+
+HOLE_BOUNDS = {C_hole: 2, G_hole: 2, A_hole: 0, V_hole: 0, Z_hole: 1, B_hole: 0}
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def cost_bound(target: Node) -> int:
+    # cost of the cheapest terminal program target expands to, with every
+    # hole counted as its cheapest completion (costs are sums over children).
+    # Completions where simplification folds arithmetic away (x + 0, x * 1,
+    # x - x, ...) can cost less, but the folded program is also generated
+    # directly from the same hole, so no program is lost
+    if target.terminal():
+        return target.cost
+    if isinstance(target, Hole):
+        return HOLE_BOUNDS[type(target)]
+    res = target.cost
+    for name in target._fields:
+        child = getattr(target, name)
+        if isinstance(child, Node):
+            res -= child.cost - cost_bound(child)
+    return res
+
+
+def deepening_round(
+    filename: str, bound: int, dedup: bool = False, meter: Meter = None
+):
+    # depth-first search of the programs whose cost_bound is at most bound.
+    # Filling a hole never lowers cost_bound, folding always does: children
+    # with a lower bound than their parent are folded programs, generated
+    # directly elsewhere, and skipping them also rules out cycles. Returns
+    # (solution or None, the smallest bound above bound that was cut, the
+    # limit that stopped the round or None, (best candidate, examples it
+    # passes, fidelity), meter)
+    gates, specification = get_spec(filename)
+    groups = group_spec(specification)
+    n, bits = specification[0].n, specification[0].bits
+    cache = PrefixCache()
+    equivalence = ObservationalEquivalence() if dedup else None
+    meter = meter or Meter()
+    incumbent = Incumbent(groups)
+    exceeded = math.inf
+
+    def visit(target: Pgm, low: int) -> Pgm:
+        nonlocal exceeded
+        reason = meter.exhausted()
+        if reason is not None:
+            raise BudgetExceeded(reason)
+        meter.count()
+        solution, expand = examine(
+            target, groups, cache, equivalence, incumbent=incumbent, meter=meter
+        )
+        if solution is not None or not expand:
+            return solution
+        for child in next(target, n, bits, gates):
+            child_low = cost_bound(child)
+            if child_low < low:
+                continue
+            if child_low > bound:
+                exceeded = min(exceeded, child_low)
+                continue
+            solution = visit(child, child_low)
+            if solution is not None:
+                return solution
+        return None
+
+    root = Pgm(C_hole())
+    try:
+        solution, reason = visit(root, cost_bound(root)), None
+    except BudgetExceeded as e:
+        solution, reason = None, e.reason
+    best = (incumbent.program, incumbent.passed, incumbent.fidelity)
+    return solution, exceeded, reason, best, meter
+
+
+def search_deepening(
+    filename: str, dedup: bool = False, budget: Budget = None, workers: int = 1
+) -> Result:
+    # iterative deepening over cost: depth-first rounds from Pgm(C_hole())
+    # with an increasing cost bound, each round starting at the smallest
+    # bound the previous one cut. Every ancestor of a program costing c has
+    # a cost_bound of at most c, so a round with bound b finds every solution
+    # costing at most b and the first solution found is a cheapest one.
+    # Nothing is kept between programs but the recursion, so memory is
+    # proportional to program depth. With workers > 1, that many
+    # consecutive bounds run at once, one process each, and the smallest
+    # bound with a solution wins; each of them gets an equal share of what
+    # is left of the node, verification and memory budgets. Once a round is
+    # stopped by its share, solutions of larger bounds are only offered as
+    # the best candidate: a cheaper one may have been cut. Rounds still
+    # running when the search returns are terminated
+    _, specification = get_spec(filename)
+    meter, incumbent = Meter(budget), Incumbent(group_spec(specification))
+    bound = cost_bound(Pgm(C_hole()))
+    if workers <= 1:
+        while bound < math.inf:
+            solution, exceeded, reason, best, _ = deepening_round(
+                filename, bound, dedup, meter
+            )
+            incumbent.offer(*best)
+            if solution is not None:
+                print(f"loop: {meter.nodes}")
+                print(f"cost bound: {bound}")
+                return meter.result(incumbent, solution, bound=bound)
+            if reason is not None:
+                return meter.result(incumbent, reason=reason, bound=bound)
+            bound = exceeded
+        return meter.result(incumbent, bound=bound)
+    pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("fork"))
+    try:
+        while bound < math.inf:
+            reason = meter.exhausted()
+            if reason is not None:
+                return meter.result(incumbent, reason=reason, bound=bound)
+            bounds = range(bound, bound + workers)
+            share = meter.remaining(workers)
+            futures = [
+                pool.submit(deepening_round, filename, b, dedup, Meter(share))
+                for b in bounds
+            ]
+            stopped = None  # first limit that cut a round
+            for b, future in zip(bounds, futures):
+                if stopped is not None and not future.done():
+                    continue  # no solution of it can be accepted
+                solution, exceeded, reason, best, used = future.result()
+                meter.nodes += used.nodes
+                meter.verifications += used.verifications
+                meter.peak = max(meter.peak, used.peak)
+                incumbent.offer(*best)
+                if solution is not None and stopped is None:
+                    print(f"loop: {meter.nodes}")
+                    print(f"cost bound: {b}")
+                    return meter.result(incumbent, solution, bound=b)
+                if solution is not None:
+                    # a smaller bound was cut before it finished, so this
+                    # solution may not be a cheapest one
+                    incumbent.offer(solution, incumbent.examples, 1.0)
+                stopped = stopped or reason
+            if stopped is not None:
+                return meter.result(incumbent, reason=stopped, bound=bound)
+            bound = exceeded  # cut by the largest bound
+        return meter.result(incumbent, bound=bound)
+    finally:
+        # rounds of larger bounds still running are not needed any more
+        for process in list(pool._processes.values()):
+            process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def terminal_prefix(target: Pgm) -> tuple:
+    # leading top-level statements that can be simulated: terminal and
+    # without rotations, whose angles are only solved after the search
+    res = []
+    for statement in flatten(target):
+        if not statement.terminal():
+            break
+        if statement.has_syntax(Ry()) or statement.has_syntax(CRy()):
+            break
+        res.append(statement)
+    return tuple(res)
+
+
+def search_astar(
+    filename: str, weight: float = 10, dedup: bool = False, budget: Budget = None
+) -> Result:
+    # search_base ordered by f = cost_bound(program) + weight * (1 - F), where
+    # F is the mean fidelity between the expected outputs and the states the
+    # terminal prefix of the program reaches on the spec inputs, taken up to
+    # a permutation of basis states (permutation_fidelity): the plain
+    # fidelity penalizes prefixes such as H(q0) for GHZ that the remaining
+    # CX gates only permute into the target. With weight 0 this is A* with
+    # an admissible bound and the first solution is a cheapest one; larger
+    # weights expand programs whose prefix is already close to the target
+    # first, at the price of optimality
+    gates, specification = get_spec(filename)
+    groups = group_spec(specification)
+    n, bits = specification[0].n, specification[0].bits
+    cache = PrefixCache()
+    equivalence = ObservationalEquivalence() if dedup else None
+    examples = sum(len(group.index) for group in groups)
+
+    @functools.lru_cache(maxsize=1 << 16)
+    def closeness(prefix: tuple) -> float:
+        if prefix:
+            states = run_batch(Pgm(sequence(list(prefix))), groups, cache)
+        else:
+            states = [group.input for group in groups]
+        res = 0.0
+        for state, group in zip(states, groups):
+            if isinstance(state, np.ndarray) and state.shape == group.output.shape:
+                res += float(np.sum(permutation_fidelity(state, group.output)))
+        return res / examples
+
+    def priority(target: Pgm) -> tuple:
+        if weight == 0:
+            return (cost_bound(target), target.depth)
+        f = cost_bound(target) + weight * (1 - closeness(terminal_prefix(target)))
+        return (round(f, 6), target.depth)
+
+    worklist = Worklist(priority)
+    worklist.put([Pgm(C_hole())])
+    meter, incumbent = Meter(budget), Incumbent(groups)
+    loop, reason = 0, None
+    while worklist.notEmpty():
+        reason = meter.exhausted()
+        if reason is not None:
+            break
+        loop += 1
+        target = worklist.get()
+        meter.count()
+        try:
+            solution, expand = examine(
+                target, groups, cache, equivalence, incumbent=incumbent, meter=meter
+            )
+        except BudgetExceeded as e:
+            reason = e.reason
+            break
+        if solution is not None:
+            print(f"loop: {loop}")
+            print(f"worklist size: {worklist.size()}")
+            return meter.result(incumbent, solution, worklist=worklist.size())
+        if expand:
+            worklist.put(next(target, n, bits, gates))
+    return meter.result(
+        incumbent, reason=reason or "exhausted", worklist=worklist.size()
+    )
+
+
+class Frontier(NamedTuple):
+    # state shared by the workers of search_parallel; lock guards in_flight,
+    # idle, best and solutions, so that "every worker idle and no message in
+    # flight" is read atomically
+    inboxes: list  # one queue of (kind, programs) messages per worker
+    results: object  # queue of (cost, depth, solution)
+    lock: object
+    in_flight: object  # messages sent and not yet received
+    idle: object  # per worker: nothing cheaper than best left to examine
+    hungry: object  # per worker: asks busy workers for programs
+    loops: object  # per worker: programs examined
+    verifications: object  # per worker: complete candidates run
+    best: object  # cost of the cheapest solution found so far
+    solutions: object  # solutions put in results
+    incumbents: object  # queue of each worker's best candidate, once stopped
+    done: object
+
+
+BATCH = 64  # programs per message to another worker
+STEAL = 32  # programs handed to a hungry worker at once
+
+
+def owner(target: Pgm, workers: int) -> int:
+    # the worker keeping target's entry of the global seen-set
+    return int.from_bytes(worklist_fingerprint(target)[:4], "little") % workers
+
+
+def send(frontier: Frontier, index: int, kind: str, programs: List[Pgm]):
+    with frontier.lock:
+        frontier.in_flight.value += 1
+    frontier.inboxes[index].put((kind, programs))
+
+
+def parallel_worker(index: int, filename: str, dedup: bool, frontier: Frontier):
+    gates, specification = get_spec(filename)
+    groups = group_spec(specification)
+    n, bits = specification[0].n, specification[0].bits
+    cache = PrefixCache()
+    equivalence = ObservationalEquivalence() if dedup else None
+    workers = len(frontier.inboxes)
+    inbox = frontier.inboxes[index]
+    worklist = Worklist()
+    outboxes = [[] for _ in range(workers)]
+    incumbent = Incumbent(groups)
+    meter = Meter(Budget(wall=None))  # search_parallel checks the limits
+    loop = 0
+
+    def receive(message):
+        kind, programs = message
+        if kind == "new":  # children this worker owns: deduplicated here
+            worklist.put(programs)
+        else:  # stolen programs, already deduplicated by their owner
+            for target in programs:
+                worklist.push(target)
+        with frontier.lock:
+            frontier.idle[index] = False
+            frontier.in_flight.value -= 1
+
+    def available() -> bool:
+        return worklist.notEmpty() and worklist.cheapest() < frontier.best.value
+
+    def flush(size: int = 1):
+        for other, programs in enumerate(outboxes):
+            if len(programs) >= size:
+                send(frontier, other, "new", programs)
+                outboxes[other] = []
+
+    def share():
+        # hands the cheapest programs to one hungry worker
+        for other in range(workers):
+            if frontier.hungry[other] and worklist.size() > STEAL:
+                frontier.hungry[other] = False
+                programs = worklist.get_batch(STEAL)
+                send(frontier, other, "stolen", programs)
+                return
+
+    while not frontier.done.is_set():
+        while True:
+            try:
+                receive(inbox.get_nowait())
+            except queue.Empty:
+                break
+        if not available():
+            flush()
+            with frontier.lock:
+                frontier.idle[index] = True
+                if all(frontier.idle) and frontier.in_flight.value == 0:
+                    frontier.done.set()
+            frontier.hungry[index] = True
+            try:
+                receive(inbox.get(timeout=0.1))
+            except queue.Empty:
+                pass
+            continue
+        frontier.hungry[index] = False
+        loop += 1
+        frontier.loops[index] = loop
+        target = worklist.get()
+        solution, expand = examine(
+            target, groups, cache, equivalence, incumbent=incumbent, meter=meter
+        )
+        frontier.verifications[index] = meter.verifications
+        if solution is not None:
+            with frontier.lock:
+                if target.cost < frontier.best.value:
+                    frontier.best.value = target.cost
+                frontier.solutions.value += 1
+                frontier.results.put((target.cost, target.depth, solution))
+            continue
+        if expand:
+            for child in next(target, n, bits, gates):
+                other = owner(child, workers)
+                if other == index:
+                    worklist.put([child])
+                else:
+                    outboxes[other].append(child)
+        flush(BATCH)
+        share()
+    frontier.incumbents.put((incumbent.program, incumbent.passed, incumbent.fidelity))
+
+
+def search_parallel(
+    filename: str, workers: int = None, dedup: bool = False, budget: Budget = None
+) -> Result:
+    # search_base over several processes. Programs are partitioned by
+    # fingerprint: each worker keeps the seen-set entries of its partition,
+    # children are sent to the worker owning them, and idle workers take the
+    # cheapest programs of busy ones. The first solution found bounds the
+    # cost: workers then only examine programs cheaper than the best solution
+    # so far, and the search ends when none is left. The result is the
+    # cheapest solution found; every queued program cheaper than it has been
+    # examined, but as in search_base a cheaper program reachable only
+    # through costlier ones is not. With dedup, each worker filters
+    # equivalent programs among those it examines only. The budget is
+    # checked here every RSS_INTERVAL seconds against the workers' counters
+    # and memory, so node and verification limits can be overshot by what
+    # the workers examine in that time.
+    workers = workers or os.cpu_count()
+    context = multiprocessing.get_context("fork")
+    frontier = Frontier(
+        inboxes=[context.Queue() for _ in range(workers)],
+        results=context.Queue(),
+        lock=context.Lock(),
+        in_flight=context.Value("i", 0, lock=False),
+        idle=context.Array("b", workers, lock=False),
+        hungry=context.Array("b", workers, lock=False),
+        loops=context.Array("q", workers, lock=False),
+        verifications=context.Array("q", workers, lock=False),
+        best=context.Value("d", float("inf"), lock=False),
+        solutions=context.Value("i", 0, lock=False),
+        incumbents=context.Queue(),
+        done=context.Event(),
+    )
+    root = Pgm(C_hole())
+    send(frontier, owner(root, workers), "new", [root])
+    processes = [
+        context.Process(
+            target=parallel_worker, args=(i, filename, dedup, frontier), daemon=True
+        )
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    _, specification = get_spec(filename)
+    meter, incumbent = Meter(budget), Incumbent(group_spec(specification))
+    meter.pids = [process.pid for process in processes]
+    reason = None
+    try:
+        while not frontier.done.wait(RSS_INTERVAL):
+            meter.nodes = sum(frontier.loops)
+            meter.verifications = sum(frontier.verifications)
+            reason = meter.exhausted()
+            if reason is not None:
+                break
+        with frontier.lock:
+            count = frontier.solutions.value
+        solutions = [frontier.results.get() for _ in range(count)]
+    finally:
+        frontier.done.set()
+        for _ in processes:
+            try:
+                incumbent.offer(*frontier.incumbents.get(timeout=1))
+            except queue.Empty:
+                break
+        for process in processes:
+            process.join(1)
+            if process.is_alive():
+                process.terminate()
+    meter.nodes = sum(frontier.loops)
+    meter.verifications = sum(frontier.verifications)
+    if not solutions:
+        return meter.result(incumbent, reason=reason or "exhausted", workers=workers)
+    cost, depth, solution = min(solutions, key=lambda res: res[:2])
+    print(f"loop: {meter.nodes} ({workers} workers)")
+    print(f"cost: {cost}")
+    return meter.result(incumbent, solution, workers=workers)
+
+
+def search_bottom_up(filename: str, budget: Budget = None) -> Result:
+    # enumerates terminal programs by increasing cost, keeping one
+    # representative per observed behavior (expression values, unrolled gate
+    # lists of loop bodies, unitaries of complete programs). Nodes are the
+    # statements enumerated, verifications the complete programs simulated
+    gates, specification = get_spec(filename)
+    groups = group_spec(specification)
+    cache = PrefixCache()
+    ns = sorted({example.n for example in specification})
+    depths = range(2)  # prune_basic allows a single loop
+    aexps = [[] for _ in depths]  # aexps[depth][cost]
+    insts = [[] for _ in depths]  # insts[depth][cost]
+    seen = [set() for _ in depths]
+    thetas = [[] for _ in depths]
+    if "Ry" in gates or "CRy" in gates:
+        for depth in depths:
+            thetas[depth] = theta_options(ns, depth)
+    basis = [np.eye(2**group.n, dtype=np.complex128) for group in groups]
+    meter, incumbent = Meter(budget), Incumbent(groups)
+    loop, cost = 0, 0
+
+    def scopes(depth: int):
+        # loop variable values in scope at the given depth, for every n
+        for n in ns:
+            for values in itertools.product(range(n), repeat=depth):
+                yield n, dict(zip(map(str, loop_vars), values), n=n)
+
+    def aexp_key(target: Aexp, depth: int):
+        res = []
+        for n, variables in scopes(depth):
+            try:
+                res.append(evaluate(target, variables))
+            except Exception:
+                res.append(None)
+        return ("aexp", tuple(res))
+
+    def body_key(target: Instruction, depth: int):
+        digest = hashlib.blake2b(digest_size=16)
+        for group in groups:
+            for n, variables in scopes(depth):
+                if n != group.n:
+                    continue
+                variables.update(program_variables(group.n, group.bits))
+                try:
+                    digest.update(repr(lower(target, variables)).encode())
+                except Exception:
+                    digest.update(b"error")
+        return ("inst", digest.digest())
+
+    def unitaries(target: Instruction):
+        # rows are the images of the basis states, one matrix per group; the
+        # output state is what a program is composed with, so it is not a
+        # sound key on its own
+        res = []
+        for group, eye in zip(groups, basis):
+            res.append(simulate(Pgm(target), eye, group.n, group.bits, cache))
+            if res[-1] is None:
+                return None
+        return res
+
+    def uses_loop_var(depth: int, *qregs: Aexp) -> bool:
+        if depth == 0:
+            return True
+        return any(q.has_syntax(loop_vars[depth - 1]) for q in qregs)
+
+    def aexp_candidates(depth: int, cost: int):
+        if cost == 0:
+            yield from [N()] + loop_vars[:depth]
+        if cost == 1:
+            yield from [Integer(0), Integer(1), Integer(2)]
+        for left in range(cost - 2):
+            for l, r in itertools.product(
+                aexps[depth][left], aexps[depth][cost - 3 - left]
+            ):
+                yield from [Add(l, r), Sub(l, r), Mul(l, r)]
+        if cost >= 4:
+            for l in aexps[depth][cost - 4]:
+                yield Div(l, Integer(2))
+
+    def inst_candidates(depth: int, cost: int):
+        if cost >= 2:
+            for qreg in aexps[depth][cost - 2]:
+                if not uses_loop_var(depth, qreg):
+                    continue
+                if "H" in gates:
+                    yield H(qreg)
+                if "X" in gates:
+                    yield X(qreg)
+                if "Ry" in gates:
+                    yield from [Ry(Integer(1), q, qreg) for q in thetas[depth]]
+            for left in range(cost - 1):
+                for qreg1, qreg2 in itertools.product(
+                    aexps[depth][left], aexps[depth][cost - 2 - left]
+                ):
+                    if qreg1 == qreg2 or not uses_loop_var(depth, qreg1, qreg2):
+                        continue
+                    if "CX" in gates:
+                        yield CX(qreg1, qreg2)
+                    if "CRy" in gates:
+                        yield from [
+                            CRy(Integer(1), q, qreg1, qreg2) for q in thetas[depth]
+                        ]
+        for left in range(cost - 4):
+            for l, r in itertools.product(
+                insts[depth][left], insts[depth][cost - 5 - left]
+            ):
+                if not isinstance(l, Seq):  # right-nested sequences only
+                    yield Seq(l, r)
+        if depth + 1 < len(depths):
+            for end in range(cost - 3):
+                for e, body in itertools.product(
+                    aexps[depth][end], insts[depth + 1][cost - 4 - end]
+                ):
+                    yield For(loop_vars[depth], Integer(0), e, body)
+                    yield For(loop_vars[depth], Integer(1), e, body)
+        if depth > 0 and cost >= 31:
+            for then in insts[depth][cost - 31]:
+                yield If(Bit(loop_vars[depth - 1]), then, Skip())
+
+    def valid_range(target: For, depth: int) -> bool:
+        for n, variables in scopes(depth):
+            try:
+                end = evaluate(target.end, variables)
+                if not evaluate(target.start, variables) < end <= n:
+                    return False
+            except Exception:
+                return False
+        return True
+
+    try:
+        while True:
+            for depth in reversed(depths):
+                aexps[depth].append([])
+                for target in aexp_candidates(depth, cost):
+                    if target.cost != cost or prune_basic(target):
+                        continue
+                    key = aexp_key(target, depth)
+                    if key not in seen[depth]:
+                        seen[depth].add(key)
+                        aexps[depth][cost].append(target)
+                insts[depth].append([])
+                for target in inst_candidates(depth, cost):
+                    if target.cost != cost or prune_basic(Pgm(target)):
+                        continue
+                    if isinstance(target, For) and not valid_range(target, depth):
+                        continue
+                    reason = meter.exhausted()
+                    if reason is not None:
+                        raise BudgetExceeded(reason)
+                    loop += 1
+                    meter.nodes += 1
+                    if depth > 0:
+                        key = body_key(target, depth)
+                    else:
+                        meter.verifications += 1
+                        matrices = unitaries(target)
+                        if matrices is None:
+                            continue  # fails on some example, so does any extension
+                        key = fingerprint([matrix.reshape(-1) for matrix in matrices])
+                    if key in seen[depth]:
+                        continue
+                    seen[depth].add(key)
+                    insts[depth][cost].append(target)
+                    if depth > 0:
+                        continue
+                    states = [
+                        group.input @ matrix for group, matrix in zip(groups, matrices)
+                    ]
+                    solution = check_batch(states, groups)
+                    incumbent.observe(Pgm(target), states, solution)
+                    if all(solution):
+                        print(f"loop: {loop}")
+                        print(f"cost: {cost}")
+                        return meter.result(incumbent, Pgm(target), cost=cost)
+            cost += 1
+    except BudgetExceeded as e:
+        return meter.result(incumbent, reason=e.reason, cost=cost)
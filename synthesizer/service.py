@@ -0,0 +1,260 @@
+import asyncio, contextlib, itertools, json, multiprocessing, os, time
+from dataclasses import dataclass
+
+from synthesizer.budget import Budget, Incumbent
+from synthesizer.search import search_base
+
+GRACE = 5.0  # seconds a worker gets to stop by itself before it is restarted
+
+# event of a finished search by Result.reason; other limits report "budget"
+EVENTS = {"solved": "solution", "wall": "timeout", "exhausted": "exhausted"}
+
+
+BEST = ("program", "passed", "examples", "fidelity")  # best candidate fields
+
+
+class Cancelled(Exception):
+    pass
+
+
+def best(incumbent: Incumbent) -> dict:
+    # the best candidate so far, in the fields of Result.to_dict
+    return {
+        "program": None if incumbent.program is None else str(incumbent.program),
+        "passed": max(incumbent.passed, 0),
+        "examples": incumbent.examples,
+        "fidelity": max(incumbent.fidelity, 0.0),
+    }
+
+
+def run_jobs(conn, cancel):
+    # worker process: runs jobs one after another, so compiled programs,
+    # interned nodes and expression tables stay warm between jobs
+    while True:
+        job = conn.recv()
+        if job is None:
+            return
+
+        def progress(loop: int, size: int, incumbent: Incumbent):
+            if cancel.is_set():
+                raise Cancelled()
+            conn.send(
+                dict(
+                    best(incumbent),
+                    id=job["id"],
+                    event="progress",
+                    loop=loop,
+                    worklist=size,
+                )
+            )
+
+        start = time.time()
+        try:
+            # the search prints as it goes; nobody reads it
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                result = search_base(
+                    job["spec"],
+                    dedup=job["dedup"],
+                    budget=job["budget"],
+                    progress=progress,
+                )
+            message = dict(result.to_dict(), event=EVENTS.get(result.reason, "budget"))
+        except Cancelled:
+            message = {"event": "cancelled"}
+        except Exception as e:
+            message = {"event": "failed", "error": str(e)}
+        conn.send(dict(message, id=job["id"], time=time.time() - start))
+
+
+class Worker:
+    # a warm worker process and the pipe it takes jobs from
+    def __init__(self, context):
+        self.context = context
+        self.start()
+
+    def start(self):
+        self.conn, child = self.context.Pipe()
+        self.cancel = self.context.Event()
+        self.process = self.context.Process(
+            target=run_jobs, args=(child, self.cancel), daemon=True
+        )
+        self.process.start()
+
+    def restart(self):
+        # a new process, for a job that does not stop by itself
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+        self.start()
+
+    def stop(self):
+        self.process.kill()
+        self.process.join()
+
+    async def receive(self, timeout: float):
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+        loop.add_reader(self.conn.fileno(), ready.set)
+        try:
+            await asyncio.wait_for(ready.wait(), timeout)
+        finally:
+            loop.remove_reader(self.conn.fileno())
+        return self.conn.recv()
+
+
+@dataclass
+class Job:
+    id: int
+    spec: object  # parsed specification JSON, or the path of one
+    dedup: bool
+    budget: Budget
+    writer: asyncio.StreamWriter
+    state: str = "queued"  # queued, running, done
+    cancelled: float = None  # time the cancellation was requested
+
+
+class Service:
+    # JSON lines over TCP. Requests:
+    #   {"op": "submit", "spec": {...} or "path.json", "timeout": s, "dedup": b,
+    #    "budget": {"nodes": k, "verifications": k, "rss": bytes}}
+    #   {"op": "cancel", "id": k}
+    #   {"op": "status"}
+    # every job event is sent back on the connection that submitted it:
+    # queued, started, progress, then one of solution, timeout, budget,
+    # exhausted, failed or cancelled. The first four carry the solution or
+    # the best candidate (program, passed, examples, fidelity) and stats;
+    # progress events carry the best candidate so far, which a job whose
+    # worker had to be restarted reports instead
+    def __init__(self, workers: int):
+        self.context = multiprocessing.get_context("fork")
+        self.workers = [Worker(self.context) for _ in range(workers)]
+        self.queue = asyncio.Queue()
+        self.jobs = {}
+        self.ids = itertools.count(1)
+
+    def emit(self, job: Job, message: dict):
+        if job.writer.is_closing():
+            return
+        job.writer.write((json.dumps(dict(message, id=job.id)) + "\n").encode())
+
+    def finish(self, job: Job, message: dict):
+        job.state = "done"
+        self.emit(job, message)
+        del self.jobs[job.id]
+
+    def cancel(self, job: Job):
+        if job.cancelled is not None:
+            return
+        job.cancelled = time.monotonic()
+        if job.state == "queued":
+            self.finish(job, {"event": "cancelled"})
+        elif job.state == "running":
+            job.worker.cancel.set()
+
+    async def dispatch(self, worker: Worker):
+        while True:
+            job = await self.queue.get()
+            if job.state != "queued":
+                continue  # cancelled while queued
+            job.state, job.worker = "running", worker
+            worker.cancel.clear()
+            worker.conn.send(
+                {"id": job.id, "spec": job.spec, "dedup": job.dedup, "budget": job.budget}
+            )
+            self.emit(job, {"event": "started"})
+            deadline = time.monotonic() + job.budget.wall + GRACE
+            last = {}  # best candidate of the last progress event
+            while True:
+                try:
+                    message = await worker.receive(1.0)
+                except asyncio.TimeoutError:
+                    now = time.monotonic()
+                    if now > deadline:
+                        worker.restart()
+                        self.finish(job, dict(last, event="timeout", reason="wall"))
+                        break
+                    if job.cancelled is not None and now > job.cancelled + GRACE:
+                        worker.restart()
+                        self.finish(job, dict(last, event="cancelled"))
+                        break
+                    continue
+                except (EOFError, OSError) as e:
+                    worker.restart()
+                    self.finish(job, {"event": "failed", "error": f"worker died: {e}"})
+                    break
+                if message["event"] != "progress":
+                    self.finish(job, message)
+                    break
+                last = {key: message[key] for key in BEST}
+                self.emit(job, message)
+
+    def submit(self, request: dict, writer: asyncio.StreamWriter) -> Job:
+        job = Job(
+            next(self.ids),
+            request["spec"],
+            bool(request.get("dedup", False)),
+            Budget(
+                **dict(request.get("budget", {}), wall=float(request.get("timeout", 3600)))
+            ),
+            writer,
+        )
+        self.jobs[job.id] = job
+        self.emit(job, {"event": "queued"})
+        self.queue.put_nowait(job)
+        return job
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        owned = []
+        try:
+            async for line in reader:
+                try:
+                    request = json.loads(line)
+                    op = request["op"]
+                    if op == "submit":
+                        owned.append(self.submit(request, writer))
+                    elif op == "cancel":
+                        self.cancel(self.jobs[request["id"]])
+                    elif op == "status":
+                        states = [job.state for job in self.jobs.values()]
+                        writer.write(
+                            (
+                                json.dumps(
+                                    {
+                                        "event": "status",
+                                        "queued": states.count("queued"),
+                                        "running": states.count("running"),
+                                        "workers": len(self.workers),
+                                    }
+                                )
+                                + "\n"
+                            ).encode()
+                        )
+                    else:
+                        raise ValueError(f"unknown op {op}")
+                except (ValueError, KeyError, TypeError) as e:
+                    writer.write((json.dumps({"event": "error", "error": str(e)}) + "\n").encode())
+                await writer.drain()
+        finally:
+            # jobs of a closed connection have nobody to report to
+            for job in owned:
+                if job.state != "done":
+                    self.cancel(job)
+            writer.close()
+
+    async def serve(self, host: str, port: int):
+        server = await asyncio.start_server(self.handle, host, port)
+        dispatchers = [asyncio.create_task(self.dispatch(w)) for w in self.workers]
+        print(f"Serving on {host}:{port} with {len(self.workers)} workers")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in dispatchers:
+                task.cancel()
+            for worker in self.workers:
+                worker.stop()
+
+
+def serve(host: str = "127.0.0.1", port: int = 8765, workers: int = None):
+    service = Service(workers or multiprocessing.cpu_count())
+    asyncio.run(service.serve(host, port))
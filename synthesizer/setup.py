@@ -1,6 +1,13 @@
-import cirq, json, numpy as np
-from typing import List
+import json, numpy as np
+from dataclasses import dataclass
+from typing import List, Union
 from synthesizer.language import *
+from synthesizer.simulator import (
+    PrefixCache,
+    simulate,
+    allclose_up_to_global_phase,
+    close_up_to_global_phase,
+)
 
 
 @dataclass
@@ -11,16 +18,30 @@ class Spec:
     output: np.ndarray
 
 
+# examples sharing n and bits, stacked so that one simulation covers them all
+@dataclass
+class SpecGroup:
+    n: int
+    bits: List[str]
+    index: List[int]
+    input: np.ndarray
+    output: np.ndarray
+
+
 class Property:
     pass
 
 class Basis:
     pass
 
-def get_spec(filename: str):
+def get_spec(filename: Union[str, dict]):
+    # filename may also be the already parsed JSON of a specification
     spec = []
-    with open(filename, "r") as file:
-        data = json.load(file)
+    if isinstance(filename, dict):
+        data = filename
+    else:
+        with open(filename, "r") as file:
+            data = json.load(file)
     gates = (
         data["gates"]
         if "gates" in data
@@ -35,9 +56,10 @@ def get_spec(filename: str):
         )
         out_sv = np.fromstring(data["examples"][i]["output"], dtype="complex", sep=",")
         if "input" in data["examples"][i]:
-            in_sv = data["examples"][i]["input"]
+            in_sv = np.fromstring(data["examples"][i]["input"], dtype="complex", sep=",")
         else:
-            in_sv = "1," + "0," * (2**n - 1)  # default input |0...0>
+            in_sv = np.zeros(2**n, dtype="complex")  # default input |0...0>
+            in_sv[0] = 1
         spec.append(
             Spec(
                 n,
@@ -49,58 +71,55 @@ def get_spec(filename: str):
     return gates, spec
 
 
-def get_pgm_args(n: int, bits: str) -> str:
-    if len(bits) == 0:
-        function = f"def pgm(n):\n"
-        execution_inst = f"pgm({n})"
-        return function, execution_inst
-    elif len(bits) == 1:
-        function = f"def pgm(n, bit):\n"
-        execution_inst = f"pgm({n}, {[bool(int(i)) for i in bits[0]]})"
-        return function, execution_inst
-    else:
-        print(f"Warning : number of bits {bits} is not handled")
-        return None
-
-
-def execute_string(target: Pgm, input: str, n: int, bits: str):
-    libraries = "import math, numpy, cirq\n\n"
-    set_parameter, call_pgm = get_pgm_args(n, bits)
-    input = f"input = [{input}]"
-    qbits = "qbits = cirq.LineQubit.range(n)"
-    init_qc = "qc = cirq.Circuit()"
-    program = str(target)
-    return_val = (
-        "return cirq.final_state_vector(qc, initial_state=input, qubit_order=qbits)"
-    )
-    code = (
-        libraries
-        + set_parameter
-        + indent(input, TAB)
-        + "\n"
-        + indent(init_qc, TAB)
-        + "\n"
-        + indent(qbits, TAB)
-        + "\n"
-        + indent(program, TAB)
-        + "\n"
-        + indent(return_val, TAB)
-    )
-    # print(code)
-    exec(code, globals())
-    try:
-        res = eval(call_pgm)
-    except Exception as e:
-        # print(f"Error: {e}")
-        # print(str(target))
-        # print("-------------------")
-        return None
+def group_spec(spec: List[Spec]) -> List[SpecGroup]:
+    groups = {}
+    for i, example in enumerate(spec):
+        key = (example.n, tuple(example.bits))
+        if key not in groups:
+            groups[key] = SpecGroup(example.n, example.bits, [], [], [])
+        groups[key].index.append(i)
+        groups[key].input.append(example.input)
+        groups[key].output.append(example.output)
+    res = []
+    for group in groups.values():
+        if len({len(i) for i in group.input + group.output}) != 1:
+            # malformed amplitudes cannot be stacked, keep them apart
+            for i, input, output in zip(group.index, group.input, group.output):
+                res.append(SpecGroup(group.n, group.bits, [i], input[None], output[None]))
+            continue
+        group.input, group.output = np.stack(group.input), np.stack(group.output)
+        res.append(group)
     return res
 
 
-def verify(target: Pgm, spec: Spec) -> bool:
+def verify(target: Pgm, spec: Spec, cache: PrefixCache = None) -> bool:
     input, output, n, bits = spec.input, spec.output, spec.n, spec.bits
-    res = execute_string(target, input, n, bits)
+    res = simulate(target, input, n, bits, cache)
     if not isinstance(res, np.ndarray):
         return False
-    return cirq.linalg.allclose_up_to_global_phase(res, output)
+    return allclose_up_to_global_phase(res, output)
+
+
+def run_batch(
+    target: Pgm, groups: List[SpecGroup], cache: PrefixCache = None
+) -> List[np.ndarray]:
+    # output states per group, None where the program cannot be executed
+    return [
+        simulate(target, group.input, group.n, group.bits, cache) for group in groups
+    ]
+
+
+def check_batch(states: List[np.ndarray], groups: List[SpecGroup]) -> np.ndarray:
+    # pass/fail flag for every example, in specification order
+    solution = np.zeros(sum(len(group.index) for group in groups), dtype=bool)
+    for res, group in zip(states, groups):
+        if not isinstance(res, np.ndarray) or res.shape != group.output.shape:
+            continue
+        solution[group.index] = close_up_to_global_phase(res, group.output)
+    return solution
+
+
+def verify_batch(
+    target: Pgm, groups: List[SpecGroup], cache: PrefixCache = None
+) -> np.ndarray:
+    return check_batch(run_batch(target, groups, cache), groups)
@@ -0,0 +1,224 @@
+import hashlib, math, numpy as np
+from collections import OrderedDict
+from typing import List, Union
+
+from synthesizer.language import *
+from synthesizer.compiler import lower
+
+SQRT_HALF = 1 / math.sqrt(2)
+
+
+######### State helpers #########
+def initial_state(input: np.ndarray, n: int) -> np.ndarray:
+    # leading axes (if any) index a batch of inputs
+    input = np.array(input, dtype=np.complex128)
+    return input.reshape(input.shape[:-1] + (2,) * n)
+
+
+def view(state: np.ndarray, n: int, fixed: dict) -> np.ndarray:
+    # qubit 0 is the most significant axis (cirq.LineQubit.range(n) order)
+    index = [slice(None)] * n
+    for qubit, value in fixed.items():
+        index[qubit] = value
+    return state[(Ellipsis, *index)]
+
+
+######### Gates (in place) #########
+def apply_h(state: np.ndarray, n: int, qubit: int, control: int = None):
+    fixed = {} if control is None else {control: 1}
+    zero, one = view(state, n, {**fixed, qubit: 0}), view(state, n, {**fixed, qubit: 1})
+    diff = zero - one
+    zero += one
+    zero *= SQRT_HALF
+    one[...] = diff
+    one *= SQRT_HALF
+
+
+def apply_x(state: np.ndarray, n: int, qubit: int, control: int = None):
+    fixed = {} if control is None else {control: 1}
+    zero, one = view(state, n, {**fixed, qubit: 0}), view(state, n, {**fixed, qubit: 1})
+    tmp = zero.copy()
+    zero[...] = one
+    one[...] = tmp
+
+
+def apply_ry(state: np.ndarray, n: int, qubit: int, theta: float, control: int = None):
+    fixed = {} if control is None else {control: 1}
+    zero, one = view(state, n, {**fixed, qubit: 0}), view(state, n, {**fixed, qubit: 1})
+    cos, sin = math.cos(theta / 2), math.sin(theta / 2)
+    tmp = zero.copy()
+    zero *= cos
+    zero -= sin * one
+    one *= cos
+    one += sin * tmp
+
+
+apply_gate = {
+    "h": lambda state, n, qubits, params: apply_h(state, n, qubits[0]),
+    "x": lambda state, n, qubits, params: apply_x(state, n, qubits[0]),
+    "cx": lambda state, n, qubits, params: apply_x(state, n, qubits[1], qubits[0]),
+    "ry": lambda state, n, qubits, params: apply_ry(state, n, qubits[0], params[0]),
+    "cry": lambda state, n, qubits, params: apply_ry(
+        state, n, qubits[1], params[0], qubits[0]
+    ),
+}
+
+
+def apply(state: np.ndarray, n: int, gates) -> np.ndarray:
+    for gate, qubits, params in gates:
+        apply_gate[gate](state, n, qubits, params)
+    return state
+
+
+######### Interpreter #########
+def program_variables(n: int, bits: List[str]) -> dict:
+    variables = {"n": n}
+    if len(bits) == 1:
+        variables["bit"] = [bool(int(i)) for i in bits[0]]
+    elif len(bits) > 1:
+        raise ValueError(f"number of bits {bits} is not handled")
+    return variables
+
+
+def execute(
+    target: Union[Pgm, Instruction],
+    state: np.ndarray,
+    n: int,
+    bits: List[str],
+    variables: dict = None,
+) -> np.ndarray:
+    # variables (n, bit and loop variables) are updated in place when given
+    if variables is None:
+        variables = program_variables(n, bits)
+    return apply(state, n, lower(target, variables))
+
+
+######### Prefix cache #########
+def flatten(target: Union[Pgm, Instruction]) -> List[Instruction]:
+    # top-level statements in execution order
+    if isinstance(target, Pgm):
+        return flatten(target.inst)
+    if isinstance(target, Seq):
+        return flatten(target.left) + flatten(target.right)
+    return [target]
+
+
+class PrefixCache:
+    # intermediate states of terminal statement prefixes, evicted LRU once the
+    # stored states exceed budget bytes
+    def __init__(self, budget: int = 128 * 2**20):
+        self.budget = budget
+        self.size = 0
+        self.states = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if key not in self.states:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.states.move_to_end(key)
+        return self.states[key]
+
+    def put(self, key, state: np.ndarray, variables: dict):
+        if key in self.states or state.nbytes > self.budget:
+            return
+        self.states[key] = (state.copy(), dict(variables))
+        self.size += state.nbytes
+        while self.size > self.budget:
+            _, (evicted, _) = self.states.popitem(last=False)
+            self.size -= evicted.nbytes
+
+    def clear(self):
+        self.states.clear()
+        self.size = 0
+
+    def execute(self, target: Pgm, input: np.ndarray, n: int, bits: List[str]):
+        statements = flatten(target)
+        key = (
+            n,
+            tuple(bits),
+            hashlib.blake2b(input.tobytes(), digest_size=16).digest(),
+        )
+        keys = []
+        for statement in statements:
+            key = (key, statement)
+            keys.append(key)
+        start, state, variables = 0, None, None
+        for k in range(len(statements), 0, -1):
+            entry = self.get(keys[k - 1])
+            if entry is not None:
+                start, state, variables = k, entry[0].copy(), dict(entry[1])
+                break
+        if state is None:
+            state, variables = initial_state(input, n), program_variables(n, bits)
+        for k in range(start, len(statements)):
+            execute(statements[k], state, n, bits, variables)
+            self.put(keys[k], state, variables)
+        return state
+
+
+def simulate(
+    target: Pgm,
+    input: np.ndarray,
+    n: int,
+    bits: List[str],
+    cache: PrefixCache = None,
+):
+    try:
+        if cache is None:
+            state = execute(target, initial_state(input, n), n, bits)
+        else:
+            state = cache.execute(target, input, n, bits)
+    except Exception as e:
+        # print(f"Error: {e}")
+        return None
+    return state.reshape(np.shape(input)[:-1] + (-1,))
+
+
+######### Comparison #########
+def dephase(values: np.ndarray) -> np.ndarray:
+    # same convention as cirq.linalg.match_global_phase
+    magnitude = np.abs(values)
+    safe = np.where(magnitude == 0, 1, magnitude)
+    return np.where(magnitude == 0, 1, np.conj(values) / safe)
+
+
+def close_up_to_global_phase(
+    a: np.ndarray, b: np.ndarray, rtol: float = 1e-5, atol: float = 1e-8
+) -> np.ndarray:
+    # row-wise allclose_up_to_global_phase over the last axis
+    k = np.argmax(np.abs(b), axis=-1)[..., None]
+    a_k = np.take_along_axis(a, k, axis=-1)
+    b_k = np.take_along_axis(b, k, axis=-1)
+    close = np.isclose(a * dephase(a_k), b * dephase(b_k), rtol=rtol, atol=atol)
+    return close.all(axis=-1)
+
+
+def allclose_up_to_global_phase(
+    a: np.ndarray, b: np.ndarray, rtol: float = 1e-5, atol: float = 1e-8
+) -> bool:
+    if a.shape != b.shape:
+        return False
+    return bool(close_up_to_global_phase(a, b, rtol, atol))
+
+
+def fidelity(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # row-wise |<a|b>|^2 / (<a|a> <b|b>) over the last axis, insensitive to
+    # global phase; 0 where a state is zero
+    overlap = np.abs(np.sum(np.conj(a) * b, axis=-1)) ** 2
+    norm = np.sum(np.abs(a) ** 2, axis=-1) * np.sum(np.abs(b) ** 2, axis=-1)
+    return np.where(norm == 0, 0.0, overlap / np.where(norm == 0, 1, norm))
+
+
+def permutation_fidelity(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # row-wise (sum_i sqrt(p_i q_i))^2 over the last axis, p and q the sorted
+    # probabilities of a and b: an upper bound on the fidelity between b and
+    # a with its basis states permuted, so X and CX leave it unchanged. 0
+    # where a state is zero
+    p = np.sort(np.abs(a) ** 2, axis=-1)
+    q = np.sort(np.abs(b) ** 2, axis=-1)
+    norm = np.sum(p, axis=-1) * np.sum(q, axis=-1)
+    overlap = np.sum(np.sqrt(p * q), axis=-1) ** 2
+    return np.where(norm == 0, 0.0, overlap / np.where(norm == 0, 1, norm))
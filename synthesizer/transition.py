@@ -1,13 +1,12 @@
-from typing import List, Union, Dict
-import sympy as sp
+from typing import Dict, Iterator, List, NamedTuple, Tuple, Union
 import itertools
+import numpy as np
 
 from synthesizer.language import *
+from synthesizer.compiler import evaluate
+from synthesizer.prune import prune_basic, prune_fill, tally
 
 loop_vars = [I(), J()]
-sym_n = sp.symbols("n")
-sym_i = sp.symbols("i")
-sym_j = sp.symbols("j")
 
 
 def fill_hole(
@@ -76,89 +75,155 @@ def fill_hole(
     return cases[type(target)]()
 
 
-def next(target: Pgm, n: int, bits: List[str], gates: List[str]) -> List[Pgm]:
+class Cursor(NamedTuple):
+    # path from the program root to its next hole: (node, field holding the
+    # hole's subtree, loop depth at the node) per ancestor, then the hole and
+    # the loop context it is filled in
+    spine: List[Tuple[object, str, int]]
+    hole: Hole
+    loop_depth: int
+    loop_range: Dict[str, Dict[str, Aexp]]
+
+
+def hole_cursor(target: Pgm, n: int) -> Cursor:
+    # walks down the leftmost unfinished subtree; terminal flags are cached,
+    # so this is proportional to depth. None when there is nothing to expand
+    # (no hole, or a loop on the way has an invalid range)
+    spine, loop_depth, loop_range = [], 0, {}
+    while not isinstance(target, Hole):
+        if isinstance(target, For):
+            loop_depth += 1
+        field = steps[type(target)](target, n, loop_depth, loop_range)
+        if field is None:
+            return None
+        spine.append((target, field, loop_depth))
+        target = getattr(target, field)
+    return Cursor(spine, target, loop_depth, loop_range)
+
+
+def program_step(target: Pgm, n: int, loop_depth: int, loop_range: dict):
+    return "inst"
+
+
+def lst_step(target: Seq, n: int, loop_depth: int, loop_range: dict):
+    return "right" if target.left.terminal() else "left"
+
+
+def for_step(target: For, n: int, loop_depth: int, loop_range: dict):
+    if not target.start.terminal():
+        return "start"
+    if not target.end.terminal():
+        return "end"
+    if target.end.has_syntax(target.var):
+        return None  # invalid range
+    end = evaluate(target.end, {"n": n})
+    if evaluate(target.start, {"n": n}) >= end or end < 0 or end > n:
+        return None  # redundant range
+    loop_range[f"{str(loop_vars[loop_depth-1])}"] = {
+        "start": target.start,
+        "end": Sub(target.end, Integer(1)),
+    }  # range(N) 이면 N-1까지
+    return "body"
+
+
+def if_step(target: If, n: int, loop_depth: int, loop_range: dict):
+    if not target.cond.terminal():
+        return "cond"
+    return "else_" if target.then.terminal() else "then"
+
+
+def single_step(target: Union[H, X, Ry], n: int, loop_depth: int, loop_range: dict):
+    return "qreg"
+
+
+def controlled_step(target: Union[CX, CRy], n: int, loop_depth: int, loop_range: dict):
+    return "qreg2" if target.qreg1.terminal() else "qreg1"
+
+
+def aexp_step(target: Aexp, n: int, loop_depth: int, loop_range: dict):
+    return "right" if target.left.terminal() else "left"
+
+
+def leaf_step(target, n: int, loop_depth: int, loop_range: dict):
+    return None
+
 
-    def program_case(target: Pgm, loop_depth: int, loop_range: Dict[str, int]):
-        res = []
-        for i in cases[type(target.inst)](target.inst, loop_depth, loop_range):
-            res.append(Pgm(i))
-        return res
-
-    def lst_case(target: Seq, loop_depth: int, loop_range: Dict[str, int]):
-        res = []
-        if target.left.terminal():
-            for i in cases[type(target.right)](target.right, loop_depth, loop_range):
-                res.append(Seq(target.left, i))
-        else:
-            for i in cases[type(target.left)](target.left, loop_depth, loop_range):
-                res.append(Seq(i, target.right))
-        return res
-
-    def for_case(target: For, loop_depth: int, loop_range: Dict[str, int]):
-        res = []
-        loop_depth += 1
-        if target.start.terminal():
-            if target.end.terminal():
-                if target.end.has_syntax(target.var):
-                    return []  # invalid range
-                exec(
-                    f"def end_val(n):\n" + indent(f"return {str(target.end)}", TAB),
-                    globals(),
-                )
-                end = eval(f"end_val({n})")
-                if int(str(target.start)) >= end or end < 0 or end > n:
-                    return []  # redundant range
-                loop_range[f"{str(loop_vars[loop_depth-1])}"] = {
-                    "start": str(target.start),
-                    "end": str(Sub(target.end, Integer(1))),
-                }  # range(N) 이면 N-1까지
-                for i in cases[type(target.body)](target.body, loop_depth, loop_range):
-                    res.append(For(target.var, target.start, target.end, i).simplify())
-            else:  # end is not terminal
-                for i in cases[type(target.end)](target.end, loop_depth, loop_range):
-                    res.append(For(target.var, target.start, i, target.body))
-        else:  # start is not terminal
-            for i in cases[type(target.start)](target.start, loop_depth, loop_range):
-                res.append(For(target.var, i, target.end, target.body))
-        return res
-
-    def if_case(target: If, loop_depth: int, loop_range: Dict[str, int]):
-        res = []
-        if target.cond.terminal():
-            if target.then.terminal():
-                for i in cases[type(target.else_)](
-                    target.else_, loop_depth, loop_range
-                ):
-                    res.append(If(target.cond, target.then, i).simplify())
-            else:  # then is not terminal
-                for i in cases[type(target.then)](target.then, loop_depth, loop_range):
-                    res.append(If(target.cond, i, target.else_))
-        else:  # cond is not terminal
-            for i in cases[type(target.cond)](target.cond, loop_depth, loop_range):
-                res.append(If(i, target.then, target.else_))
-        return res
-
-    def singleQ_gate(
-        target: Union[H, X, Ry], loop_depth: int, loop_range: Dict[str, int]
-    ):
-        res = []
-        for i in cases[type(target.qreg)](target.qreg, loop_depth, loop_range):
+steps = {
+    Pgm: program_step,
+    Seq: lst_step,
+    For: for_step,
+    If: if_step,
+    H: single_step,
+    X: single_step,
+    Ry: single_step,
+    CX: controlled_step,
+    CRy: controlled_step,
+    Add: aexp_step,
+    Sub: aexp_step,
+    Mul: aexp_step,
+    Div: aexp_step,
+    Integer: leaf_step,
+    I: leaf_step,
+    J: leaf_step,
+    N: leaf_step,
+    Bit: leaf_step,
+    Skip: leaf_step,
+}
+
+
+def next(target: Pgm, n: int, bits: List[str], gates: List[str]) -> List[Pgm]:
+    # fills the hole under the cursor and rebuilds only the spine above it;
+    # children that break a prune rule are dropped as soon as the part of the
+    # spine that breaks it is built, so only surviving programs are returned
+    cursor = hole_cursor(target, n)
+    if cursor is None:
+        return []
+    context = tally(target)
+    res = [
+        i
+        for i in fill_hole(cursor.hole, bits, gates, cursor.loop_depth)
+        if not prune_fill(context, i)
+    ]
+
+    def program_case(target: Pgm, field: str, loop_depth: int):
+        return [Pgm(i) for i in res]
+
+    def lst_case(target: Seq, field: str, loop_depth: int):
+        if field == "right":
+            return [Seq(target.left, i) for i in res]
+        return [Seq(i, target.right) for i in res]
+
+    def for_case(target: For, field: str, loop_depth: int):
+        if field == "body":
+            return [For(target.var, target.start, target.end, i).simplify() for i in res]
+        if field == "end":
+            return [For(target.var, target.start, i, target.body) for i in res]
+        return [For(target.var, i, target.end, target.body) for i in res]
+
+    def if_case(target: If, field: str, loop_depth: int):
+        if field == "else_":
+            return [If(target.cond, target.then, i).simplify() for i in res]
+        if field == "then":
+            return [If(target.cond, i, target.else_) for i in res]
+        return [If(i, target.then, target.else_) for i in res]
+
+    def singleQ_gate(target: Union[H, X, Ry], field: str, loop_depth: int):
+        children = []
+        for i in res:
             if i.terminal():
                 if loop_depth != 0 and not i.has_syntax(loop_vars[loop_depth - 1]):
                     continue
                 # 0 <= qreg < n
-                if basic_constraints(i, n, loop_range):
-                    res.append(type(target)(qreg=i))
+                if basic_constraints(i, n, cursor.loop_range):
+                    children.append(type(target)(qreg=i))
             else:
-                res.append(type(target)(qreg=i))
-        return res
-
-    def multiQ_gate(
-        target: Union[CX, CRy], loop_depth: int, loop_range: Dict[str, int]
-    ):
-        res = []
-        if target.qreg1.terminal():
-            for i in cases[type(target.qreg2)](target.qreg2, loop_depth, loop_range):
+                children.append(type(target)(qreg=i))
+        return children
+
+    def multiQ_gate(target: Union[CX, CRy], field: str, loop_depth: int):
+        children = []
+        if field == "qreg2":
+            for i in res:
                 if i.terminal():
                     if (
                         loop_depth != 0
@@ -167,28 +232,26 @@ def next(target: Pgm, n: int, bits: List[str], gates: List[str]) -> List[Pgm]:
                     ):
                         continue
                     # target != control & 0 <= qreg < n
-                    if i != target.qreg1 and basic_constraints(i, n, loop_range):
-                        res.append(type(target)(qreg1=target.qreg1, qreg2=i))
+                    if i != target.qreg1 and basic_constraints(
+                        i, n, cursor.loop_range
+                    ):
+                        children.append(type(target)(qreg1=target.qreg1, qreg2=i))
                 else:
-                    res.append(type(target)(qreg1=target.qreg1, qreg2=i))
+                    children.append(type(target)(qreg1=target.qreg1, qreg2=i))
         else:  # qreg1 is not terminal
-            for i in cases[type(target.qreg1)](target.qreg1, loop_depth, loop_range):
+            for i in res:
                 if i.terminal():
                     # 0 <= qreg < n
-                    if basic_constraints(i, n, loop_range):
-                        res.append(type(target)(qreg1=i, qreg2=target.qreg2))
+                    if basic_constraints(i, n, cursor.loop_range):
+                        children.append(type(target)(qreg1=i, qreg2=target.qreg2))
                 else:
-                    res.append(type(target)(qreg1=i, qreg2=target.qreg2))
-        return res
-
-    def aexp_case(
-        target: Union[Div, Mul, Add, Sub],
-        loop_depth: int,
-        loop_range: Dict[str, int],
-    ):
-        res = []
-        if target.left.terminal():
-            for i in cases[type(target.right)](target.right, loop_depth, loop_range):
+                    children.append(type(target)(qreg1=i, qreg2=target.qreg2))
+        return children
+
+    def aexp_case(target: Union[Div, Mul, Add, Sub], field: str, loop_depth: int):
+        children = []
+        if field == "right":
+            for i in res:
                 if (
                     not (target.left.has_syntax(Integer()) and i.has_syntax(Integer()))
                     and not (target.left.has_syntax(N()) and i.has_syntax(N()))
@@ -200,38 +263,18 @@ def next(target: Pgm, n: int, bits: List[str], gates: List[str]) -> List[Pgm]:
                     )
                 ):  # avoid using int/n/i/j/k in aexp more than once (TODO: 나중에 수정할수도 있음 e.g. 2 * n - 1)
                     try:
-                        res.append(type(target)(target.left, i).simplify())
+                        children.append(type(target)(target.left, i).simplify())
                     except ZeroDivisionError:
                         pass
         else:  # left is not terminal
-            for i in cases[type(target.left)](target.left, loop_depth, loop_range):
+            for i in res:
                 try:
-                    res.append(type(target)(i, target.right).simplify())
+                    children.append(type(target)(i, target.right).simplify())
                 except ZeroDivisionError:
                     pass
-        return res
-
-    def itself(
-        target: Union[Integer, I, J, N, Bit, Skip],
-        loop_depth: int,
-        loop_range: Dict[str, int],
-    ):
-        return []
-
-    def hole_case(
-        target: Union[C_hole, G_hole, A_hole, V_hole, Z_hole],
-        loop_depth: int,
-        loop_range: Dict[str, int],
-    ):
-        return fill_hole(target, bits, gates, loop_depth)
+        return children
 
     cases = {
-        C_hole: hole_case,
-        G_hole: hole_case,
-        A_hole: hole_case,
-        B_hole: hole_case,
-        V_hole: hole_case,
-        Z_hole: hole_case,
         Pgm: program_case,
         Seq: lst_case,
         For: for_case,
@@ -245,143 +288,150 @@ def next(target: Pgm, n: int, bits: List[str], gates: List[str]) -> List[Pgm]:
         Sub: aexp_case,
         Mul: aexp_case,
         Div: aexp_case,
-        Integer: itself,
-        I: itself,
-        J: itself,
-        N: itself,
-        Bit: itself,
-        Skip: itself,
     }
-    return cases[type(target)](target, loop_depth=0, loop_range={})
+    for node, field, loop_depth in reversed(cursor.spine):
+        res = [i for i in cases[type(node)](node, field, loop_depth) if not prune_basic(i)]
+    return res
 
 
 # exp가 0 <= exp < n 조건을 만족하면 True
-def basic_constraints(exp: Aexp, n: int, loop_range: dict[str, dict[str, int]]) -> bool:
-
-    exp_low = str(exp)
-    if exp_low.find("i") >= 0:
-        exp_low = exp_low.replace("i", loop_range["i"]["start"])
-    if exp_low.find("j") >= 0:
-        j_start = loop_range["j"]["start"].replace(
-            "i", loop_range["i"]["start"]
-        )  # j range에 i가 사용된 경우
-        exp_low = exp_low.replace("j", j_start)
-    if exp_low.find("k") >= 0:
-        k_start = loop_range["k"]["start"].replace(
-            "i", loop_range["i"]["start"]
-        )  # k range에 i가 사용된 경우
-        k_start = k_start.replace(
-            "j", loop_range["j"]["start"]
-        )  # k range에 j가 사용된 경우
-        exp_low = exp_low.replace("k", k_start)
-    if exp_low.find("n") >= 0:
-        exp_low = exp_low.replace("n", f"{n}")
-
-    exp_high = str(exp)
-    if exp_high.find("i") >= 0:  # i가 있는 경우
-        exp_high = exp_high.replace(
-            "i", loop_range["i"]["end"]
-        )  # i를 range의 end로 대체
-    if exp_high.find("j") >= 0:
-        j_end = loop_range["j"]["end"].replace(
-            "i", loop_range["i"]["end"]
-        )  # j range에 i가 사용된 경우
-        exp_high = exp_high.replace("j", j_end)
-    if exp_high.find("k") >= 0:
-        k_end = loop_range["k"]["end"].replace(
-            "j", loop_range["j"]["end"]
-        )  # k range에 j가 사용된 경우
-        k_end = k_end.replace("i", loop_range["i"]["end"])  # k range에 i가 사용된 경우
-        exp_high = exp_high.replace("k", k_end)
-    if exp_high.find("n") >= 0:
-        exp_high = exp_high.replace("n", f"{n}")
-
-    if (
-        eval(exp_low) >= 0
-        and eval(exp_low) < n
-        and eval(exp_high) >= 0
-        and eval(exp_high) < n
-    ):
+def basic_constraints(
+    exp: Aexp, n: int, loop_range: Dict[str, Dict[str, Aexp]]
+) -> bool:
+    low, high = {"n": n}, {"n": n}
+    for var in loop_range:  # outer loop first, j range에 i가 사용된 경우
+        low[var] = evaluate(loop_range[var]["start"], low)
+        high[var] = evaluate(loop_range[var]["end"], high)  # i를 range의 end로 대체
+    exp_low, exp_high = evaluate(exp, low), evaluate(exp, high)
+    if exp_low >= 0 and exp_low < n and exp_high >= 0 and exp_high < n:
         return True
     else:
         return False
 
 
-def fill_theta(n: int, target: Pgm, loop_depth: int) -> List[Pgm]:
-    symbol = [sym_i, sym_j]
-
-    def program_case(target: Pgm, loop_depth: int):
-        res = []
-        for i in cases[type(target.inst)](target.inst, loop_depth)[0]:
-            res.append(Pgm(i))
-        return res, loop_depth
-
-    def lst_case(target: Seq, loop_depth: int):
-        res = []
-        for i in cases[type(target.left)](target.left, loop_depth)[0]:
-            for j in cases[type(target.right)](target.right, loop_depth)[0]:
-                res.append(Seq(i, j))
-        return res, loop_depth
-
-    def for_case(target: For, loop_depth: int):
-        loop_depth += 1
-        res = []
-        for i in cases[type(target.body)](target.body, loop_depth)[0]:
-            res.append(For(target.var, target.start, target.end, i))
-        return res, loop_depth
-
-    def if_case(target: If, loop_depth: int):
-        res = []
-        for i in cases[type(target.then)](target.then, loop_depth)[0]:
-            for j in cases[type(target.else_)](target.else_, loop_depth)[0]:
-                res.append(If(target.cond, i, j))
-        return res, loop_depth
-
-    def ry_case(target: Ry, loop_depth: int):
-        res = []
-        for i in generate_exp(n, symbol[:loop_depth]):
-            res.append(Ry(str(1), str(i), target.qreg))
-        return res, loop_depth
-
-    def cry_case(target: CRy, loop_depth: int):
-        res = []
-        for i in generate_exp(n, symbol[:loop_depth]):
-            res.append(CRy(str(1), str(i), target.qreg1, target.qreg2))
-        return res, loop_depth
-
-    def else_case(target, loop_depth):
-        return [target], loop_depth
-
-    cases = {
-        Pgm: program_case,
-        Seq: lst_case,
-        For: for_case,
-        If: if_case,
-        Ry: ry_case,
-        CRy: cry_case,
-        H: else_case,
-        X: else_case,
-        CX: else_case,
-        Skip: else_case,
-    }
+Path = Tuple[str, ...]
+
+
+def rotation_paths(target, path: Path = ()) -> List[Tuple[Path, int]]:
+    # unfilled Ry/CRy nodes in execution order, with their loop depth
+    if isinstance(target, Pgm):
+        return rotation_paths(target.inst, path)
+    if isinstance(target, Seq):
+        return rotation_paths(target.left, path + ("left",)) + rotation_paths(
+            target.right, path + ("right",)
+        )
+    if isinstance(target, For):
+        return rotation_paths(target.body, path + ("body",))
+    if isinstance(target, If):
+        return rotation_paths(target.then, path + ("then",)) + rotation_paths(
+            target.else_, path + ("else_",)
+        )
+    if isinstance(target, (Ry, CRy)) and target.q is None:
+        return [(path, path.count("body"))]
+    return []
+
+
+def fill(target, thetas: Dict[Path, Aexp], path: Path = (), p: Aexp = Integer(1)):
+    # copy of target with every unfilled rotation set to Ry(p, q)
+    if isinstance(target, Pgm):
+        return Pgm(fill(target.inst, thetas, path, p))
+    if isinstance(target, Seq):
+        return Seq(
+            fill(target.left, thetas, path + ("left",), p),
+            fill(target.right, thetas, path + ("right",), p),
+        )
+    if isinstance(target, For):
+        body = fill(target.body, thetas, path + ("body",), p)
+        return For(target.var, target.start, target.end, body)
+    if isinstance(target, If):
+        then = fill(target.then, thetas, path + ("then",), p)
+        return If(target.cond, then, fill(target.else_, thetas, path + ("else_",), p))
+    if isinstance(target, Ry) and target.q is None:
+        return Ry(p, thetas.get(path, Integer(1)), target.qreg)
+    if isinstance(target, CRy) and target.q is None:
+        return CRy(p, thetas.get(path, Integer(1)), target.qreg1, target.qreg2)
+    return target
+
+
+def theta_options(ns: List[int], loop_depth: int) -> List[Aexp]:
+    # expressions valid for every n in the specification, simplest first
+    key = (loop_depth, tuple(sorted(set(ns))))
+    if key not in theta_orders:
+        valid = None
+        for n in key[1]:
+            rows = {tuple(row) for row in exp_table(n, loop_depth)[0]}
+            valid = rows if valid is None else valid & rows
+        coeffs, exps = exp_table(key[1][0], loop_depth)
+        exps = [e for row, e in zip(coeffs, exps) if tuple(row) in valid]
+        theta_orders[key] = sorted(exps, key=lambda e: e.cost)
+    return theta_orders[key]
+
+
+def rank_tuples(sizes: List[int], total: int) -> Iterator[Tuple[int, ...]]:
+    # index tuples below sizes whose entries add up to total
+    if len(sizes) == 0:
+        if total == 0:
+            yield ()
+        return
+    for k in range(min(sizes[0] - 1, total) + 1):
+        for rest in rank_tuples(sizes[1:], total - k):
+            yield (k,) + rest
+
+
+def fill_theta(ns: List[int], target: Pgm, order=None) -> Iterator[Pgm]:
+    # lazily yields target with one expression per unfilled rotation, the
+    # same for every example; assignments with a smaller rank sum come first.
+    # order(path, options), if given, reranks the options of a rotation
+    paths = rotation_paths(target)
+    options = [theta_options(ns, depth) for _, depth in paths]
+    if order is not None:
+        options = [order(path, exps) for (path, _), exps in zip(paths, options)]
+    sizes = [len(exps) for exps in options]
+    for total in range(sum(size - 1 for size in sizes) + 1):
+        for ranks in rank_tuples(sizes, total):
+            thetas = {
+                path: exps[k] for (path, _), exps, k in zip(paths, options, ranks)
+            }
+            yield fill(target, thetas)
+
+
+COEFFS = [2, 1, 0, -1, -2]
+
+# rotation denominators per (loop depth, n), built once
+exp_tables = {}
+theta_orders = {}
+
+
+def exp_table(n: int, loop_depth: int) -> Tuple[np.ndarray, List[Aexp]]:
+    # integer coefficient rows over (loop variables, n, 1) that are positive
+    # with every loop variable at n - 1, and the matching aexps
+    key = (loop_depth, n)
+    if key not in exp_tables:
+        coeffs = np.array(list(itertools.product(COEFFS, repeat=loop_depth + 2)))
+        keep = coeffs @ np.array([n - 1] * loop_depth + [n, 1]) > 0
+        variables = loop_vars[:loop_depth] + [N(), None]
+        exps = [
+            linear_aexp(list(zip(map(int, row), variables))) for row in coeffs[keep]
+        ]
+        exp_tables[key] = (coeffs[keep], exps)
+    return exp_tables[key]
 
-    return cases[type(target)](target, loop_depth)[0]
 
+def generate_exp(n: int, loop_depth: int) -> List[Aexp]:
+    return exp_table(n, loop_depth)[1]
 
-def generate_exp(n: int, variables: List[sp.Symbol]) -> List[sp.Expr]:
 
-    COEFFS = [2, 1, 0, -1, -2]
-    vars_to_generate = variables + [sym_n] + [1]  # list of variables + n + constant
-    coeff_candidates = list(itertools.product(*([COEFFS] * len(vars_to_generate))))
-    res = []
+def linear_aexp(terms: List[Tuple[int, Aexp]]) -> Aexp:
+    # sum of coeff * var (var None for the constant), positive terms first
+    def term(coeff: int, var: Aexp) -> Aexp:
+        if var is None:
+            return Integer(abs(coeff))
+        return var if abs(coeff) == 1 else Mul(Integer(abs(coeff)), var)
 
-    for coeffs in coeff_candidates:
-        alg_exp = 0
-        for coeff, var in zip(coeffs, vars_to_generate):
-            alg_exp += coeff * var
-        i = n - 1  # eval 함수에서 i를 사용하기 위함
-        if (
-            alg_exp not in res and not eval(str(alg_exp)) <= 0
-        ):  # loop depth 1인 경우만 처리
-            res.append(alg_exp)
+    terms = [(c, v) for c, v in terms if c > 0] + [(c, v) for c, v in terms if c < 0]
+    if len(terms) == 0:
+        return Integer(0)
+    res = term(*terms[0]) if terms[0][0] > 0 else Sub(Integer(0), term(*terms[0]))
+    for coeff, var in terms[1:]:
+        res = Add(res, term(coeff, var)) if coeff > 0 else Sub(res, term(coeff, var))
     return res
@@ -1,28 +1,331 @@
-from synthesizer.language import Pgm
-from queue import PriorityQueue
+import hashlib, heapq, os, pickle, shutil, sys, tempfile, weakref, zlib
+from collections import deque
+from typing import List
+from synthesizer.language import Node, Pgm
+
+
+DIGEST = 16  # bytes per fingerprint
+
+
+def fingerprint(element: Node) -> bytes:
+    # digest of the structure: the node type and its fields, children by
+    # their own digests. Cached on the interned node like prune.tally, so a
+    # child only hashes the spine its expansion rebuilt, and independent of
+    # the process, unlike hash(), so it can be saved in checkpoints
+    res = element._digest
+    if res is None:
+        key = (type(element).__name__,) + tuple(
+            fingerprint(value) if isinstance(value, Node) else value
+            for value in map(element.__getattribute__, element._fields)
+        )
+        res = hashlib.blake2b(repr(key).encode(), digest_size=DIGEST).digest()
+        object.__setattr__(element, "_digest", res)
+    return res
 
 
 class Worklist:
-    def __init__(self):
-        self.current_set = PriorityQueue()
+    # bucket queue: one FIFO per (cost, depth), popped cheapest first, which
+    # is the (cost, depth, insertion count) order of a priority queue. With
+    # priority, buckets are keyed by priority(program) instead, a tuple whose
+    # first element plays the part of the cost
+    def __init__(self, priority=None):
+        self.priority = priority
+        self.buckets = {}
+        self.keys = []  # heap of the bucket keys
+        self.length = 0
         self.count = 0
-        self.overall_set = []
+        self.overall_set = set()  # fingerprints of every program ever enqueued
 
     def put(self, enqueue):
         for element in enqueue:
-            if element not in self.overall_set:
+            key = fingerprint(element)
+            if key not in self.overall_set:
                 self.count += 1
-                self.current_set.put((element.cost, element.depth, self.count, element))
-                self.overall_set.append(element)
+                self.push(element)
+                self.overall_set.add(key)
+
+    def push(self, element: Pgm):
+        if self.priority is None:
+            key = (element.cost, element.depth)
+        else:
+            key = self.priority(element)
+        if key not in self.buckets:
+            self.buckets[key] = deque()
+            heapq.heappush(self.keys, key)
+        self.buckets[key].append(element)
+        self.length += 1
+
+    def push_front(self, element: Pgm):
+        # element goes before the programs of its bucket, where a program
+        # popped and not finished was (see search_base's resume)
+        if self.priority is None:
+            key = (element.cost, element.depth)
+        else:
+            key = self.priority(element)
+        if key not in self.buckets:
+            self.buckets[key] = deque()
+            heapq.heappush(self.keys, key)
+        self.buckets[key].appendleft(element)
+        self.length += 1
 
     def get(self) -> Pgm:
-        return self.current_set.get_nowait()[-1]
+        if self.length == 0:
+            raise IndexError("get from an empty worklist")
+        key = self.keys[0]
+        bucket = self.buckets[key]
+        element = bucket.popleft()
+        if not bucket:
+            del self.buckets[key]
+            heapq.heappop(self.keys)
+        self.length -= 1
+        return element
+
+    def get_batch(self, k: int = None) -> List[Pgm]:
+        # up to k programs (all when k is None) of the cheapest cost, in order
+        res = []
+        if self.length == 0:
+            return res
+        cost = self.keys[0][0]
+        while self.length > 0 and self.keys[0][0] == cost:
+            if k is not None and len(res) >= k:
+                break
+            res.append(self.get())
+        return res
+
+    def cheapest(self) -> int:
+        # cost of the next program to pop
+        return self.keys[0][0]
+
+    def size(self) -> int:
+        return self.length
+
+    def seen(self, element: Pgm) -> bool:
+        return fingerprint(element) in self.overall_set
+
+    def seen_size(self) -> int:
+        return len(self.overall_set)
+
+    def seen_memory(self) -> int:
+        # bytes held by the seen-set: the hash table plus one digest per entry
+        return sys.getsizeof(self.overall_set) + len(self.overall_set) * sys.getsizeof(
+            bytes(DIGEST)
+        )
+
+    def __getstate__(self):
+        # the seen-set pickles as one string of digests, much smaller than a
+        # set of bytes objects
+        state = self.__dict__.copy()
+        state["overall_set"] = b"".join(self.overall_set)
+        return state
+
+    def __setstate__(self, state: dict):
+        state.setdefault("priority", None)  # checkpoints from before priority
+        seen = state["overall_set"]
+        state["overall_set"] = {
+            seen[i : i + DIGEST] for i in range(0, len(seen), DIGEST)
+        }
+        self.__dict__.update(state)
 
     def show_set(self):
-        print(self.overall_set)
+        print(f"{self.seen_size()} programs seen ({self.seen_memory()} bytes)")
 
     def show_pq(self):
-        print(self.current_set.queue)
+        for key in sorted(self.buckets):
+            print(key, list(self.buckets[key]))
 
     def notEmpty(self) -> bool:
-        return self.current_set.not_empty
+        return self.length > 0
+
+
+BATCH = 1024  # programs per record of a segment file
+
+
+def record(batch: List[Pgm]) -> bytes:
+    data = zlib.compress(pickle.dumps(batch, protocol=pickle.HIGHEST_PROTOCOL))
+    return len(data).to_bytes(4, "little") + data
+
+
+class Segment:
+    # append-only file of one (cost, depth) bucket: records are length
+    # prefixed, compressed pickles of up to BATCH programs, read back in the
+    # order they were written. The file is open only while a record is
+    # written or read, so deep searches do not run out of file descriptors
+    def __init__(self, path: str):
+        self.path = path
+        open(path, "wb").close()
+        self.buffer = []  # programs not written yet, behind those on disk
+        self.read = 0  # offset of the next unread record
+        self.end = 0
+        self.size = 0  # programs on disk or in the buffer
+
+    def append(self, element: Pgm):
+        self.buffer.append(element)
+        self.size += 1
+        if len(self.buffer) >= BATCH:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        data = record(self.buffer)
+        with open(self.path, "ab") as file:
+            file.write(data)
+        self.end += len(data)
+        self.buffer = []
+
+    def load(self) -> List[Pgm]:
+        # the oldest record, or the buffer once the file is read
+        if self.read == self.end:
+            batch, self.buffer = self.buffer, []
+        else:
+            with open(self.path, "rb") as file:
+                file.seek(self.read)
+                length = int.from_bytes(file.read(4), "little")
+                batch = pickle.loads(zlib.decompress(file.read(length)))
+            self.read += 4 + length
+        self.size -= len(batch)
+        return batch
+
+    def dump(self):
+        # unread programs as (count, records), for pickling
+        with open(self.path, "rb") as file:
+            file.seek(self.read)
+            data = file.read(self.end - self.read)
+        return self.size, data + (record(self.buffer) if self.buffer else b"")
+
+    def restore(self, size: int, data: bytes):
+        with open(self.path, "wb") as file:
+            file.write(data)
+        self.end, self.size = len(data), size
+
+    def close(self):
+        os.remove(self.path)
+
+
+class SpillingWorklist(Worklist):
+    # Worklist keeping about `resident` programs in memory: when it holds
+    # more, the most expensive (cost, depth) buckets move to segment files
+    # and are read back record by record when the search reaches them.
+    # Programs pushed to a spilled bucket are appended to its file, behind
+    # the ones in memory, so the pop order is the same as Worklist's; until
+    # a record is full they wait in the segment's buffer and count as
+    # resident. The seen-set stays in memory (16 bytes per program)
+    def __init__(self, resident: int, directory: str = None):
+        super().__init__()
+        self.resident = resident
+        self.in_memory = 0
+        self.segments = {}
+        self.open(directory)
+
+    def open(self, directory: str = None):
+        self.parent = directory
+        self.directory = tempfile.mkdtemp(prefix="qupsy-worklist-", dir=directory)
+        self.cleanup = weakref.finalize(self, shutil.rmtree, self.directory, True)
+
+    def push(self, element: Pgm):
+        key = (element.cost, element.depth)
+        if key not in self.buckets and key not in self.segments:
+            heapq.heappush(self.keys, key)
+        self.length += 1
+        if key in self.segments:
+            segment = self.segments[key]
+            buffered = len(segment.buffer)
+            segment.append(element)
+            self.in_memory += len(segment.buffer) - buffered
+        else:
+            if key not in self.buckets:
+                self.buckets[key] = deque()
+            self.buckets[key].append(element)
+            self.in_memory += 1
+        if self.in_memory > self.resident:
+            self.spill()
+
+    def push_front(self, element: Pgm):
+        # in memory even for a spilled bucket: its read-back part comes
+        # before the segment file
+        key = (element.cost, element.depth)
+        if key not in self.buckets and key not in self.segments:
+            heapq.heappush(self.keys, key)
+        if key not in self.buckets:
+            self.buckets[key] = deque()
+        self.buckets[key].appendleft(element)
+        self.length += 1
+        self.in_memory += 1
+        if self.in_memory > self.resident:
+            self.spill()
+
+    def get(self) -> Pgm:
+        if self.length == 0:
+            raise IndexError("get from an empty worklist")
+        key = self.keys[0]
+        bucket = self.buckets.get(key)
+        if not bucket:
+            segment = self.segments[key]
+            buffered = len(segment.buffer)
+            bucket = self.buckets[key] = deque(segment.load())
+            # a batch read from the file is new in memory, the buffer is not
+            self.in_memory += len(bucket) - (buffered - len(segment.buffer))
+            if segment.size == 0:
+                segment.close()
+                del self.segments[key]
+        element = bucket.popleft()
+        self.in_memory -= 1
+        self.length -= 1
+        if not bucket:
+            del self.buckets[key]
+            if key not in self.segments:
+                heapq.heappop(self.keys)
+        return element
+
+    def spill(self):
+        # moves the most expensive buckets to disk until half the budget is
+        # used, and writes out the buffers of spilled ones; the bucket being
+        # popped and the read-back part of spilled buckets stay
+        for key in sorted(self.buckets.keys() | self.segments.keys(), reverse=True):
+            if self.in_memory <= self.resident // 2:
+                break
+            if key in self.segments:
+                segment = self.segments[key]
+                self.in_memory -= len(segment.buffer)
+                segment.flush()
+                continue
+            if key == self.keys[0]:
+                continue
+            cost, depth = key
+            segment = Segment(os.path.join(self.directory, f"{cost}_{depth}.seg"))
+            bucket = self.buckets.pop(key)
+            for element in bucket:
+                segment.append(element)
+            segment.flush()
+            self.segments[key] = segment
+            self.in_memory -= len(bucket)
+
+    def spilled(self) -> int:
+        return self.length - self.in_memory
+
+    def __getstate__(self):
+        # spilled programs are part of the state, so a pickled worklist does
+        # not depend on the spill directory
+        state = super().__getstate__()
+        state["segments"] = {key: segment.dump() for key, segment in self.segments.items()}
+        # segment buffers are restored on disk
+        state["in_memory"] -= sum(len(segment.buffer) for segment in self.segments.values())
+        for name in ("directory", "cleanup"):
+            del state[name]
+        return state
+
+    def __setstate__(self, state: dict):
+        segments = state.pop("segments")
+        super().__setstate__(state)
+        self.open(self.parent)
+        self.segments = {}
+        for (cost, depth), (size, data) in segments.items():
+            segment = Segment(os.path.join(self.directory, f"{cost}_{depth}.seg"))
+            segment.restore(size, data)
+            self.segments[(cost, depth)] = segment
+
+    def show_pq(self):
+        super().show_pq()
+        for key in sorted(self.segments):
+            segment = self.segments[key]
+            print(key, f"{segment.size - len(segment.buffer)} programs on disk")